@@ -0,0 +1,79 @@
+from typing import Optional
+import numpy as np
+
+# BSON element types with a fixed-size value -> the NumPy dtype of the value
+FIXED_TYPES = {
+    0x01: '<f8',  # double
+    0x07: '12u1', # ObjectId (12 bytes per row)
+    0x08: '?',    # bool
+    0x09: '<i8',  # UTC datetime (ms since the epoch)
+    0x10: '<i4',  # int32
+    0x12: '<i8',  # int64
+}
+DOCUMENT, STRING, DATETIME = 0x03, 0x02, 0x09
+
+def _layout(data : bytes, start : int, prefix : str, fields : dict, structure : list) -> int:
+    """
+    Walks one BSON document, recording the offset, dtype and type of every value by dotted path, and the byte ranges
+    that are not values (lengths, types, keys and terminators)
+    :returns: The offset after the document
+    """
+    structure.append((start, start + 4))
+    pos = start + 4
+    while data[pos] != 0:
+        kind = data[pos]
+        key_end = data.index(b'\x00', pos + 1)
+        path = prefix + data[pos + 1:key_end].decode()
+        structure.append((pos, key_end + 1))
+        pos = key_end + 1
+        if kind == DOCUMENT:
+            pos = _layout(data, pos, path + '.', fields, structure)
+        elif kind == STRING:
+            size = int.from_bytes(data[pos:pos + 4], 'little') # Including the terminator
+            structure.append((pos, pos + 4))
+            fields[path] = (pos + 4, f'S{size - 1}', kind)
+            pos += 4 + size
+            structure.append((pos - 1, pos))
+        elif kind in FIXED_TYPES:
+            fields[path] = (pos, FIXED_TYPES[kind], kind)
+            pos += np.dtype(FIXED_TYPES[kind]).itemsize
+        else:
+            raise ValueError(f'Unsupported BSON type {kind:#x} in {path}')
+    structure.append((pos, pos + 1))
+    return pos + 1
+
+def decode_columns(batch : bytes) -> Optional[dict[str, np.ndarray]]:
+    """
+    Decodes a batch of BSON documents (e.g. of find_raw_batches) straight into NumPy arrays, without a Python object per document.
+    The layout of the first document is read once and every document is then viewed through one structured dtype, which only
+    works when all documents have the same layout: the same fields in the same order, with the same types and string lengths.
+    Projected TrackPoints do. Every other batch returns None and has to be decoded with bson.decode_all.
+    :param batch: The concatenated documents
+    :returns: An array per dotted field path (strings as bytes, ObjectIds as rows of 12 uint8, datetimes as datetime64[ms]),
+              None if the documents do not share a layout
+    """
+    length = int.from_bytes(batch[:4], 'little')
+    if length < 5 or len(batch) % length:
+        return None
+    fields, structure = {}, []
+    try:
+        _layout(batch, 0, '', fields, structure)
+    except ValueError:
+        return None
+
+    # Every document must have the bytes of the first one wherever they are not values (this also checks every length prefix)
+    rows = np.frombuffer(batch, np.uint8).reshape(-1, length)
+    mask = np.concatenate([np.arange(low, high) for low, high in structure])
+    if not (rows[:, mask] == rows[0, mask]).all():
+        return None
+
+    dtype = np.dtype({'names': list(fields),
+                      'formats': [field[1] for field in fields.values()],
+                      'offsets': [field[0] for field in fields.values()],
+                      'itemsize': length})
+    records = np.frombuffer(batch, dtype)
+    columns = {}
+    for path, (_, _, kind) in fields.items():
+        column = np.ascontiguousarray(records[path])
+        columns[path] = column.view('datetime64[ms]') if kind == DATETIME else column
+    return columns
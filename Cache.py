@@ -0,0 +1,114 @@
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Optional, Union
+import hashlib
+import pickle
+import threading
+
+MISSING = object()
+
+class QueryCache:
+    """
+    A cache for the results of the part2 questions. Entries are kept in memory (LRU) and optionally pickled to a directory,
+    so they survive between runs. Keys contain the dataset generation, so entries are invalidated by every load,
+    and prune() drops the entries of older generations.
+
+    Example:
+    cache = QueryCache(directory='.query_cache')
+    run_query(db, 'q7', cache=cache)
+    """
+    def __init__(self, maxsize : int = 128, directory : Optional[Union[str, Path]] = None) -> None:
+        """
+        Initialize the cache
+        :param maxsize: The maximum number of entries kept in memory
+        :param directory: The directory entries are also stored in (None = memory only)
+        """
+        self.maxsize = maxsize
+        self.directory = Path(directory) if directory is not None else None
+        if self.directory:
+            self.directory.mkdir(parents=True, exist_ok=True)
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(name : str, params : dict, generation : int) -> tuple:
+        """
+        Creates the key of a question
+        :param name: The name of the question
+        :param params: The parameters of the question (e.g. user, date range, coordinates)
+        :param generation: The dataset generation
+        :returns: The key (the generation is its last item)
+        """
+        return (name, tuple(sorted(params.items())), generation)
+
+    def _path(self, key : tuple) -> Path:
+        # The file name starts with the generation, so prune() does not have to unpickle anything
+        return self.directory / f'{key[-1]}-{hashlib.sha1(repr(key).encode()).hexdigest()}.pickle'
+
+    def get(self, key : tuple) -> Any:
+        """
+        Looks up an entry
+        :param key: The key
+        :returns: The cached value, MISSING if there is none
+        """
+        with self._lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return self.entries[key]
+        if self.directory and self._path(key).exists():
+            with open(self._path(key), 'rb') as f:
+                value = pickle.load(f)
+            self._remember(key, value)
+            self.hits += 1
+            return value
+        self.misses += 1
+        return MISSING
+
+    def put(self, key : tuple, value : Any) -> None:
+        """
+        Stores an entry
+        :param key: The key
+        :param value: The value (must be picklable when a directory is used)
+        """
+        self._remember(key, value)
+        if self.directory:
+            with open(self._path(key), 'wb') as f:
+                pickle.dump(value, f)
+
+    def _remember(self, key : tuple, value : Any) -> None:
+        with self._lock:
+            self.entries[key] = value
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+
+    def prune(self, generation : int) -> int:
+        """
+        Removes the entries of every other generation (also from the directory), they can never be hit again
+        :param generation: The current dataset generation
+        :returns: The number of entries removed from memory and the directory
+        """
+        with self._lock:
+            stale = [key for key in self.entries if key[-1] != generation]
+            for key in stale:
+                del self.entries[key]
+        removed = len(stale)
+        if self.directory:
+            for path in self.directory.glob('*.pickle'):
+                if not path.name.startswith(f'{generation}-'):
+                    path.unlink(missing_ok=True)
+                    removed += 1
+        return removed
+
+    def clear(self) -> None:
+        """
+        Removes every entry (also from the directory)
+        """
+        with self._lock:
+            self.entries.clear()
+        if self.directory:
+            for path in self.directory.glob('*.pickle'):
+                path.unlink()
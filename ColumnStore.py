@@ -0,0 +1,218 @@
+from Database import Database
+from PltParser import parse_plt, MAX_POINTS
+from Labels import LabelIndex
+from datetime import timedelta
+from pathlib import Path
+from typing import Optional, Union
+import numpy as np
+import argparse
+import json
+import shutil
+
+# The columns of the store, one file each: name -> dtype
+POINT_COLUMNS = {'lat': 'f8', 'lon': 'f8', 'altitude': 'f8', 'date_time': 'datetime64[s]', 'activity': 'i4'}
+ACTIVITY_COLUMNS = {'activity_user': 'i4', 'activity_mode': 'i2'} # Per activity: index into users, index into modes (-1 = no mode)
+NO_MODE = -1
+
+class ColumnStore:
+    """
+    A local, read-only columnar copy of the TrackPoints. Every column is a flat binary file that is memory-mapped, so analysis
+    reads the pages it touches instead of pulling the points from MongoDB. Points are grouped by activity and activities by user:
+    activity_offsets[i]:activity_offsets[i + 1] are the points of activity i, user_offsets[u]:user_offsets[u + 1] the activities of user u.
+
+    Example:
+    ColumnStore.from_database(Database(), 'trackpoints.store')
+    store = ColumnStore('trackpoints.store')
+    points = store.user_points('112')
+    store.lat[points]
+    """
+    def __init__(self, path : Union[str, Path]) -> None:
+        """
+        Opens a store (nothing is read until the columns are accessed)
+        :param path: The directory of the store
+        """
+        self.path = Path(path)
+        with open(self.path / 'meta.json') as f:
+            meta = json.load(f)
+        self.source = meta['source']
+        self.generation = meta['generation']
+        self.users = meta['users']
+        self.modes = meta['modes']
+        self.activities = meta['activities']
+        self.user_index = {user : i for i, user in enumerate(self.users)}
+        self.built = (self.path / 'meta.json').stat().st_mtime_ns # Changes whenever the store is rebuilt
+        for name, dtype in POINT_COLUMNS.items():
+            setattr(self, name, self._open(name, dtype, meta['points']))
+        for name, dtype in ACTIVITY_COLUMNS.items():
+            setattr(self, name, self._open(name, dtype, len(self.activities)))
+        self.activity_offsets = self._open('activity_offsets', 'i8', len(self.activities) + 1)
+        self.user_offsets = self._open('user_offsets', 'i8', len(self.users) + 1)
+
+    def _open(self, name : str, dtype : str, length : int) -> np.ndarray:
+        if length == 0: # Empty files cannot be mapped
+            return np.empty(0, dtype)
+        return np.memmap(self.path / f'{name}.bin', dtype=dtype, mode='r', shape=(length,))
+
+    def __len__(self) -> int:
+        return len(self.lat)
+
+    def user_activities(self, user : Union[str, int]) -> range:
+        """
+        Gets the activities of a user
+        :param user: The ID or index of the user
+        :returns: The indexes of the activities
+        """
+        u = self.user_index[user] if isinstance(user, str) else user
+        return range(int(self.user_offsets[u]), int(self.user_offsets[u + 1]))
+
+    def user_points(self, user : Union[str, int]) -> slice:
+        """
+        Gets the points of a user
+        :param user: The ID or index of the user
+        :returns: The slice of the point columns
+        """
+        activities = self.user_activities(user)
+        return slice(int(self.activity_offsets[activities.start]), int(self.activity_offsets[activities.stop]))
+
+    def activity_points(self, activity : int) -> slice:
+        """
+        Gets the points of an activity
+        :param activity: The index of the activity
+        :returns: The slice of the point columns
+        """
+        return slice(int(self.activity_offsets[activity]), int(self.activity_offsets[activity + 1]))
+
+    @staticmethod
+    def from_database(database : Database, path : Union[str, Path], batch_size : int = 100000) -> 'ColumnStore':
+        """
+        Builds a store from the TrackPoint collection (one ordered, columnar scan per user)
+        :param database: The database
+        :param path: The directory of the store (replaced if it exists)
+        :param batch_size: The number of TrackPoints per batch
+        :returns: The store
+        :raises ValueError: If the database was written to during the export (the existing store is kept)
+        """
+        generation = database.generation() # Read before the scan, a load during the scan must not be stamped as exported
+        writer = _StoreWriter(path)
+        modes = {activity['_id'] : activity['transportation_mode'] for activity in database.db.Activity.find({}, {'transportation_mode': 1})}
+        for user in sorted(database.db.User.distinct('_id')):
+            codes = {}
+            for columns in database.trackpoint_columns(('lat', 'lon', 'altitude', 'date_time'), {'activity.user': user}, batch_size=batch_size, codes=codes):
+                writer.add_points(columns['activity'], columns['lat'], columns['lon'], columns['altitude'], columns['date_time'].astype('datetime64[s]'))
+            for activity in codes: # In the order of their codes
+                writer.add_activity(str(activity), user, modes.get(activity))
+        if database.generation() != generation:
+            writer.discard()
+            raise ValueError(f'The database changed while {path} was exported (generation {generation} -> {database.generation()}), build it again')
+        return writer.close('database', generation)
+
+    @staticmethod
+    def from_plt(root : Union[str, Path], path : Union[str, Path], label_tolerance : Optional[timedelta] = None) -> 'ColumnStore':
+        """
+        Builds a store directly from a Geolife dataset, with the same rules as part1 (activities of more than 2500 points are skipped)
+        :param root: The dataset directory (containing Data/ and labeled_ids.txt)
+        :param path: The directory of the store (replaced if it exists)
+        :param label_tolerance: Also match labels that overlap an activity within this tolerance (None = exact start/end matches only)
+        :returns: The store
+        """
+        root = Path(root)
+        with open(root / 'labeled_ids.txt') as f:
+            labeled = set(f.read().split())
+        writer = _StoreWriter(path)
+        for user_dir in sorted(directory for directory in (root / 'Data').iterdir() if directory.is_dir()):
+            labels = LabelIndex.from_file(user_dir / 'labels.txt') if user_dir.name in labeled else None
+            for file in sorted((user_dir / 'Trajectory').glob('*.plt')):
+                plt = parse_plt(file)
+                if len(plt) == 0 or len(plt) > MAX_POINTS:
+                    continue
+                start, end = plt.date_time[0].item(), plt.date_time[-1].item()
+                writer.add_points(np.zeros(len(plt), np.int64), plt.lat, plt.lon, plt.altitude, plt.date_time)
+                writer.add_activity(file.as_posix(), user_dir.name, labels.lookup(start, end, label_tolerance) if labels else None)
+        return writer.close('plt', None)
+
+class _StoreWriter:
+    """
+    Appends activities to the column files of a store, writing into a temporary directory that replaces the store when closed
+    """
+    def __init__(self, path : Union[str, Path]) -> None:
+        self.path = Path(path)
+        self.tmp = self.path.with_name(self.path.name + '.tmp')
+        shutil.rmtree(self.tmp, ignore_errors=True)
+        self.tmp.mkdir(parents=True)
+        self.files = {name : open(self.tmp / f'{name}.bin', 'wb') for name in (*POINT_COLUMNS, *ACTIVITY_COLUMNS, 'activity_offsets', 'user_offsets')}
+        self.users = []
+        self.modes = []
+        self.activities = []
+        self.points = 0
+        self.pending = {} # Activity index -> number of points added before the activity
+        self._write('activity_offsets', [0])
+        self._write('user_offsets', [0])
+
+    def _write(self, name : str, values) -> None:
+        self.files[name].write(np.asarray(values, dtype=(POINT_COLUMNS | ACTIVITY_COLUMNS).get(name, 'i8')).tobytes())
+
+    def add_points(self, activity : np.ndarray, lat : np.ndarray, lon : np.ndarray, altitude : np.ndarray, date_time : np.ndarray) -> None:
+        """
+        Appends points. activity is the code of each point's activity relative to the next add_activity() call (0, 1, ...).
+        """
+        self._write('activity', activity + len(self.activities))
+        for code, count in enumerate(np.bincount(activity).tolist()):
+            index = len(self.activities) + code
+            self.pending[index] = self.pending.get(index, 0) + count
+        self._write('lat', lat)
+        self._write('lon', lon)
+        self._write('altitude', altitude)
+        self._write('date_time', date_time)
+
+    def add_activity(self, id : str, user : str, mode : Optional[str]) -> None:
+        """
+        Closes the next activity. Activities are added in order of their codes, and grouped by user.
+        """
+        if mode is not None and mode not in self.modes:
+            self.modes.append(mode)
+        if not self.users or self.users[-1] != user:
+            if self.users:
+                self._write('user_offsets', [len(self.activities)])
+            self.users.append(user)
+        self.activities.append(id)
+        self._write('activity_user', [len(self.users) - 1])
+        self._write('activity_mode', [self.modes.index(mode) if mode is not None else NO_MODE])
+        self.points += self.pending.pop(len(self.activities) - 1, 0)
+        self._write('activity_offsets', [self.points])
+
+    def close(self, source : str, generation : Optional[int]) -> ColumnStore:
+        """
+        Finishes the store and opens it
+        """
+        if self.users:
+            self._write('user_offsets', [len(self.activities)])
+        for file in self.files.values():
+            file.close()
+        with open(self.tmp / 'meta.json', 'w') as f:
+            json.dump({'source': source, 'generation': generation, 'points': self.points,
+                       'users': self.users, 'modes': self.modes, 'activities': self.activities}, f)
+        shutil.rmtree(self.path, ignore_errors=True)
+        self.tmp.rename(self.path)
+        return ColumnStore(self.path)
+
+    def discard(self) -> None:
+        """
+        Removes the temporary directory without replacing the store
+        """
+        for file in self.files.values():
+            file.close()
+        shutil.rmtree(self.tmp, ignore_errors=True)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Build the local columnar TrackPoint store used by the _store questions of part2')
+    parser.add_argument('source', choices=('database', 'plt'), help='Export the TrackPoint collection or parse the .plt files directly')
+    parser.add_argument('-o', '--output', default='trackpoints.store', help='The directory of the store')
+    parser.add_argument('-d', '--dataset', default='dataset', help='The dataset directory (plt only)')
+    parser.add_argument('--label-tolerance', type=float, default=None, help='Match labels that overlap an activity within this many seconds (plt only)')
+    args = parser.parse_args()
+
+    if args.source == 'database':
+        store = ColumnStore.from_database(Database(profile='analytics'), args.output)
+    else:
+        store = ColumnStore.from_plt(args.dataset, args.output, timedelta(seconds=args.label_tolerance) if args.label_tolerance is not None else None)
+    print(f'Stored {len(store)} points of {len(store.activities)} activities and {len(store.users)} users in {args.output}')
@@ -1,17 +1,227 @@
 from DbConnector import DbConnector
-from Schema import User, Activity, TrackPoint
-from typing import Union
+from Instrumentation import CommandRecorder
+from BsonColumns import decode_columns
+from contextlib import nullcontext
+from concurrent.futures import ThreadPoolExecutor
+from Schema import User, Activity, TrackPoint, ManifestEntry
+from bson.objectid import ObjectId
+from bson.raw_bson import RawBSONDocument
+from pymongo import IndexModel, UpdateOne, ASCENDING, GEOSPHERE
+from pymongo.collection import Collection
+from pymongo.errors import BulkWriteError, PyMongoError
+from pymongo.write_concern import WriteConcern
+from typing import Union, Optional, Iterable, Iterator
+from itertools import groupby
+import bson
 import logging
+import numpy as np
+import time
+
+BULK_WRITE_CONCERN = WriteConcern(w=1, j=False) # Acknowledged but not journaled, used for bulk loading
+EARTH_RADIUS_METERS = 6371008.8 # The mean earth radius, same as the haversine package
+
+# The secondary indexes the loader and the part2 queries need, per collection
+INDEXES = {
+    'TrackPoint': [
+        IndexModel([('activity._id', ASCENDING), ('seq', ASCENDING)], name='activity_seq'),                            # Range reads of activities in order (q7, q9), removing an activity's points
+        IndexModel([('activity.user', ASCENDING), ('activity._id', ASCENDING), ('seq', ASCENDING)], name='user_activity_seq'), # q8 sort, columnar scans of a user
+        IndexModel([('location', GEOSPHERE)], name='location'),                                                        # q10 (users near a point)
+    ],
+    'TrackPointBucket': [
+        IndexModel([('activity._id', ASCENDING), ('seq', ASCENDING)], name='activity_seq'),                            # Buckets of an activity in order
+    ],
+    'Activity': [
+        IndexModel([('transportation_mode', ASCENDING)], name='transportation_mode'),                                  # q4, q5, q11
+        IndexModel([('user', ASCENDING), ('transportation_mode', ASCENDING)], name='user_transportation_mode'),         # q7
+    ],
+    'Manifest': [
+        IndexModel([('user', ASCENDING)], name='user'),                                                                # Manifest of a user
+    ],
+}
+
+def id_range(field : str, bounds : Optional[tuple]) -> dict:
+    """
+    Creates the filter of a range returned by Database.id_ranges()
+    :param field: The field the range applies to (e.g. 'activity.user')
+    :param bounds: The (low, high) range (None = no filter)
+    :returns: The filter
+    """
+    if bounds is None:
+        return {}
+    low, high = bounds
+    condition = {**({'$gte': low} if low is not None else {}), **({'$lt': high} if high is not None else {})}
+    return {field: condition} if condition else {}
+
+class BulkResult:
+    """
+    The (possibly partial) result of a streaming bulk write
+    """
+    def __init__(self) -> None:
+        self.inserted = 0
+        self.batches = 0
+        self.errors = []
+
+    @property
+    def ok(self) -> bool:
+        """
+        Whether every document was written
+        """
+        return not self.errors
+
+    def __repr__(self) -> str:
+        return f'BulkResult(inserted={self.inserted}, batches={self.batches}, errors={len(self.errors)})'
+
+class BulkWriter:
+    """
+    Buffers documents and writes them with unordered bulk inserts whenever a batch is full.
+    Memory use is bounded by the batch size (times the number of batches in flight) instead of the number of documents.
+
+    Example:
+    with db.bulk_writer('TrackPoint', batch_size=5000) as writer:
+        for trackpoint in trackpoints:
+            writer.add(trackpoint)
+    print(writer.result)
+    """
+    def __init__(self,
+                 collection : Collection,
+                 batch_size : int = 10000,
+                 max_bytes : Optional[int] = None,
+                 write_concern : Optional[WriteConcern] = None,
+                 in_flight : int = 1,
+                 recorder : Optional[CommandRecorder] = None) -> None:
+        """
+        Initialize the writer
+        :param collection: The collection to write to
+        :param batch_size: Flush after this many documents
+        :param max_bytes: Also flush when the BSON size of the buffered documents reaches this many bytes (None = no limit)
+        :param write_concern: The write concern of the inserts (None = the collection's default)
+        :param in_flight: The number of batches that are written at the same time (1 = every batch is written before the next one is buffered)
+        :param recorder: The recorder of the database, the batches written by the executor are attributed to the phase they were sent in
+        """
+        self.collection = collection.with_options(write_concern=write_concern) if write_concern else collection
+        self.batch_size = batch_size
+        self.max_bytes = max_bytes
+        self.batch = []
+        self.batch_bytes = 0
+        self.result = BulkResult()
+        self.in_flight = in_flight
+        self.recorder = recorder
+        self._executor = ThreadPoolExecutor(max_workers=in_flight) if in_flight > 1 else None
+        self._pending = [] # Futures of the batches in flight, oldest first
+
+    def add(self, document : dict) -> None:
+        """
+        Buffers a document, flushing the batch if it is full
+        :param document: The document to be inserted
+        """
+        self.batch.append(document)
+        if self.max_bytes is not None:
+            self.batch_bytes += len(document.raw) if isinstance(document, RawBSONDocument) else len(bson.encode(document))
+        if len(self.batch) >= self.batch_size or (self.max_bytes is not None and self.batch_bytes >= self.max_bytes):
+            self._send()
+
+    def extend(self, documents : Iterable[dict]) -> None:
+        """
+        Buffers every document of an iterable (e.g. a generator)
+        :param documents: The documents to be inserted
+        """
+        for document in documents:
+            self.add(document)
+
+    def _send(self) -> None:
+        """
+        Starts writing the buffered documents, waiting for the oldest batch if too many are in flight
+        """
+        if not self.batch:
+            return
+        batch = self.batch
+        self.batch = []
+        self.batch_bytes = 0
+        self.result.batches += 1
+        if self._executor is None:
+            self._collect(self._write(batch))
+            return
+        if len(self._pending) >= self.in_flight:
+            self._collect(self._pending.pop(0).result())
+        phase = self.recorder.current_phase() if self.recorder else None
+        self._pending.append(self._executor.submit(self._write_in_phase, phase, batch))
+
+    def _write_in_phase(self, phase : Optional[str], batch : list[dict]) -> tuple[int, list[dict]]:
+        # Runs on the executor: the phase of a thread is thread-local, so the phase of the sending thread is entered again here
+        with self.recorder.phase(phase) if self.recorder else nullcontext():
+            return self._write(batch)
+
+    def _write(self, batch : list[dict]) -> tuple[int, list[dict]]:
+        """
+        Writes a batch with one unordered bulk insert (runs on the executor when batches are in flight).
+        Failures are recorded in the result instead of being raised, so the caller decides what to do with a partial write.
+        :returns: The number of inserted documents and the write errors
+        """
+        try:
+            inserted, errors = len(self.collection.insert_many(batch, ordered=False).inserted_ids), []
+        except BulkWriteError as e:
+            inserted, errors = e.details.get('nInserted', 0), e.details.get('writeErrors', [])
+            logging.critical(f'A bulk write into {self.collection.name} partially failed ({inserted}/{len(batch)} inserted) -> \n{e}')
+        except PyMongoError as e: # E.g. AutoReconnect, a timeout or DocumentTooLarge: how much was written is unknown
+            inserted, errors = 0, [{'errmsg': str(e), 'code': getattr(e, 'code', None), 'documents': len(batch)}]
+            logging.critical(f'A bulk write into {self.collection.name} failed ({len(batch)} documents) -> \n{e}')
+        logging.info(f'Inserted {inserted} documents into: {self.collection.name}')
+        return inserted, errors
+
+    def _collect(self, written : tuple[int, list[dict]]) -> None:
+        self.result.inserted += written[0]
+        self.result.errors.extend(written[1])
+
+    def flush(self) -> None:
+        """
+        Writes the buffered documents and waits until every batch in flight is written
+        """
+        self._send()
+        while self._pending:
+            self._collect(self._pending.pop(0).result())
+
+    def close(self) -> None:
+        """
+        Flushes the writer and stops its threads (also when the flush raises)
+        """
+        try:
+            self.flush()
+        finally:
+            if self._executor is not None:
+                self._executor.shutdown()
+
+    def __enter__(self) -> 'BulkWriter':
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.close()
 
 class Database:
     """
     A class for performing database operations (insertions, queries, collection creation, etc.)
     """
-    def __init__(self) -> None:
-        self.connection = DbConnector()
+    def __init__(self, profile : str = 'default', instrument : bool = False, **options) -> None:
+        """
+        Connects to the database
+        :param profile: The connection profile ('default', 'ingest' or 'analytics', see DbConnector.PROFILES)
+        :param instrument: Record every command and connection pool event in self.recorder (uses its own client)
+        :param options: MongoClient options that override the profile
+        """
+        self.recorder = CommandRecorder() if instrument else None
+        if self.recorder:
+            options['event_listeners'] = [self.recorder]
+        self.connection = DbConnector(profile=profile, **options)
         self.client = self.connection.client
         self.db = self.connection.db
     
+    def phase(self, name : str):
+        """
+        Attributes the commands sent by the current thread to a named phase (no-op without instrumentation)
+        :param name: The name of the phase
+        :returns: A context manager
+        """
+        return self.recorder.phase(name) if self.recorder else nullcontext()
+
     def create_collection(self, name : str) -> bool:
         """
         Creates a new collection
@@ -26,6 +236,14 @@ class Database:
         logging.info(f'Created a new collection: {collection}')
         return True
     
+    def has_collection(self, name : str) -> bool:
+        """
+        Checks whether a collection exists
+        :param name: The name of the collection
+        :returns: True if it exists, False if not
+        """
+        return name in self.db.list_collection_names()
+
     def insert_documents(self, collection : str, data : Union[Union[Activity, User, TrackPoint], list[Union[Activity, User, TrackPoint]]]) -> bool:
         """
         Inserts documents into the database
@@ -45,6 +263,42 @@ class Database:
         logging.info(f'Inserted data into: {collection}')
         return True
     
+    def bulk_writer(self,
+                    collection : str,
+                    batch_size : int = 10000,
+                    max_bytes : Optional[int] = None,
+                    write_concern : Optional[WriteConcern] = None,
+                    in_flight : int = 1) -> BulkWriter:
+        """
+        Creates a streaming bulk writer for a collection
+        :param collection: The name of the collection for inserting
+        :param batch_size: Flush after this many documents
+        :param max_bytes: Also flush when the buffered documents reach this many BSON bytes (None = no limit)
+        :param write_concern: The write concern of the inserts, e.g. BULK_WRITE_CONCERN (None = default)
+        :param in_flight: The number of batches that are written at the same time
+        :returns: The bulk writer
+        """
+        return BulkWriter(self.db[collection], batch_size, max_bytes, write_concern, in_flight, self.recorder)
+
+    def stream_documents(self,
+                         collection : str,
+                         documents : Iterable[Union[Activity, User, TrackPoint]],
+                         batch_size : int = 10000,
+                         max_bytes : Optional[int] = None,
+                         write_concern : Optional[WriteConcern] = None) -> BulkResult:
+        """
+        Inserts the documents of an iterable (e.g. a generator) in bounded batches
+        :param collection: The name of the collection for inserting
+        :param documents: The documents to be inserted
+        :param batch_size: Flush after this many documents
+        :param max_bytes: Also flush when the buffered documents reach this many BSON bytes (None = no limit)
+        :param write_concern: The write concern of the inserts (None = default)
+        :returns: The number of inserted documents and the errors of any partially failed batches
+        """
+        with self.bulk_writer(collection, batch_size, max_bytes, write_concern) as writer:
+            writer.extend(documents)
+        return writer.result
+
     def insert_user(self, user : Union[User, list[User]]) -> bool:
         """
         Inserts a/multiple Users into the database
@@ -82,4 +336,468 @@ class Database:
             logging.critical(f'An error occured in drop_collection() -> \n{e}')
             return False
         logging.info(f'Dropped {collection}!')
-        return True
\ No newline at end of file
+        return True
+
+    def upsert_user(self, user : User) -> bool:
+        """
+        Inserts a User, or appends its activities to the User if it already exists
+        :param user: The User document
+        :returns: True if successful, False if not
+        """
+        try:
+            self.db.User.update_one({'_id': user['_id']},
+                                    {
+                                        '$set': {'has_labels': user['has_labels']},
+                                        '$push': {'activities': {'$each': user['activities']}}
+                                    },
+                                    upsert=True)
+        except Exception as e:
+            logging.critical(f'An error occured in upsert_user() -> \n{e}')
+            return False
+        logging.info(f'Upserted User: {user["_id"]}')
+        return True
+
+    def remove_activity(self, activity : ObjectId, user : str) -> bool:
+        """
+        Removes an Activity, its TrackPoints (or TrackPointBuckets) and the reference from its User
+        :param activity: The ID of the Activity
+        :param user: The ID of the User the Activity belongs to
+        :returns: True if successful, False if not
+        """
+        try:
+            self.db.TrackPoint.delete_many({'activity._id': activity})
+            self.db.TrackPointBucket.delete_many({'activity._id': activity})
+            removed = self.db.Activity.find_one_and_delete({'_id': activity})
+            self.db.User.update_one({'_id': user}, {'$pull': {'activities': activity}})
+        except Exception as e:
+            logging.critical(f'An error occured in remove_activity() -> \n{e}')
+            return False
+        logging.info(f'Removed Activity: {activity}')
+        if removed:
+            self.rollup_activities([removed], -1) # The Activity is gone either way, a failed update marks the rollups stale
+        return True
+
+    def rollup_activities(self, activities : list[Activity], sign : int = 1) -> bool:
+        """
+        Merges Activities into the Rollup collection (number of activities and summed duration per user, year and transportation mode).
+        A failed update marks the rollups stale, so the loader rebuilds them (rollup_stale()).
+        :param activities: The Activity documents
+        :param sign: 1 when the Activities were inserted, -1 when they were removed
+        :returns: True if successful, False if not
+        """
+        rollups = {}
+        for activity in activities:
+            key = (activity['user'], activity['start_date_time'].year, activity['transportation_mode'])
+            count, duration = rollups.get(key, (0, 0))
+            rollups[key] = (count + 1, duration + (activity['end_date_time'] - activity['start_date_time']).total_seconds())
+        if not rollups:
+            return True
+        try:
+            self.db.Rollup.bulk_write([UpdateOne({'_id': {'user': user, 'year': year, 'transportation_mode': mode}},
+                                                 {'$inc': {'count': sign * count, 'duration': sign * duration}},
+                                                 upsert=True) for (user, year, mode), (count, duration) in rollups.items()],
+                                      ordered=False)
+            if sign < 0:
+                self.db.Rollup.delete_many({'count': {'$lte': 0}})
+        except Exception as e:
+            logging.critical(f'An error occured in rollup_activities() -> \n{e}')
+            self.mark_rollup_stale()
+            return False
+        return True
+
+    def mark_rollup_stale(self) -> bool:
+        """
+        Records that the Rollup collection no longer matches the Activities (an incremental update failed part way)
+        :returns: True if successful, False if not
+        """
+        try:
+            self.db.Meta.update_one({'_id': 'rollup'}, {'$set': {'stale': True}}, upsert=True)
+        except Exception as e:
+            logging.critical(f'An error occured in mark_rollup_stale() -> \n{e}')
+            return False
+        return True
+
+    def rollup_stale(self) -> bool:
+        """
+        Checks whether the Rollup collection has to be rebuilt
+        :returns: True if an incremental update failed since the last rebuild
+        """
+        meta = self.db.Meta.find_one({'_id': 'rollup'})
+        return bool(meta and meta.get('stale'))
+
+    def rebuild_rollup(self) -> bool:
+        """
+        Recomputes the Rollup collection from every Activity (e.g. for data loaded before the rollups existed)
+        :returns: True if successful, False if not
+        """
+        try:
+            self.db.Meta.delete_one({'_id': 'rollup'}) # Cleared first, an update that fails during the rebuild marks it again
+            self.db.Activity.aggregate([
+                {
+                    '$group':
+                    {
+                        '_id': {'user': '$user', 'year': {'$year': '$start_date_time'}, 'transportation_mode': '$transportation_mode'},
+                        'count': {'$sum': 1},
+                        'duration': {'$sum': {'$divide': [{'$subtract': ['$end_date_time', '$start_date_time']}, 1000]}}
+                    }
+                },
+                {
+                    '$out': 'Rollup'
+                }
+            ], allowDiskUse=True)
+        except Exception as e:
+            logging.critical(f'An error occured in rebuild_rollup() -> \n{e}')
+            self.mark_rollup_stale()
+            return False
+        logging.info('Rebuilt the Rollup collection')
+        return self.bump_generation() # The _rollup questions may answer differently
+
+    def get_manifest(self, user : str) -> dict[str, ManifestEntry]:
+        """
+        Gets the manifest entries of a user
+        :param user: The ID of the user
+        :returns: The entries keyed by file path
+        """
+        return {entry['_id'] : entry for entry in self.db.Manifest.find({'user': user})}
+
+    def upsert_manifest(self, entry : ManifestEntry) -> bool:
+        """
+        Inserts or replaces a manifest entry
+        :param entry: The ManifestEntry document
+        :returns: True if successful, False if not
+        """
+        try:
+            self.db.Manifest.replace_one({'_id': entry['_id']}, entry, upsert=True)
+        except Exception as e:
+            logging.critical(f'An error occured in upsert_manifest() -> \n{e}')
+            return False
+        return True
+
+    def complete_manifest(self, paths : list[str]) -> bool:
+        """
+        Marks manifest entries as done once their Activities are fully inserted
+        :param paths: The file paths of the entries
+        :returns: True if successful, False if not
+        """
+        try:
+            self.db.Manifest.update_many({'_id': {'$in': paths}}, {'$set': {'status': 'done'}})
+        except Exception as e:
+            logging.critical(f'An error occured in complete_manifest() -> \n{e}')
+            return False
+        return True
+
+    def delete_manifest(self, paths : list[str]) -> bool:
+        """
+        Deletes manifest entries (e.g. of files that no longer exist)
+        :param paths: The file paths of the entries
+        :returns: True if successful, False if not
+        """
+        try:
+            self.db.Manifest.delete_many({'_id': {'$in': paths}})
+        except Exception as e:
+            logging.critical(f'An error occured in delete_manifest() -> \n{e}')
+            return False
+        return True
+
+    def generation(self) -> int:
+        """
+        Gets the dataset generation, a counter that is bumped by every write of the loader (cached query results of older generations are stale)
+        :returns: The generation (0 if nothing was ever loaded)
+        """
+        meta = self.db.Meta.find_one({'_id': 'generation'})
+        return meta['value'] if meta else 0
+
+    def bump_generation(self) -> bool:
+        """
+        Bumps the dataset generation, call it after every write to the data
+        :returns: True if successful, False if not
+        """
+        try:
+            self.db.Meta.update_one({'_id': 'generation'}, {'$inc': {'value': 1}}, upsert=True)
+        except Exception as e:
+            logging.critical(f'An error occured in bump_generation() -> \n{e}')
+            return False
+        return True
+
+    def ensure_indexes(self, collections : Optional[Iterable[str]] = None) -> list[dict]:
+        """
+        Builds the standard secondary indexes (INDEXES) of the existing collections. Indexes that already exist are left alone.
+        :param collections: The collections to build indexes for (None = all collections in INDEXES)
+        :returns: A report with the build time (seconds) and size (bytes) of every index
+        """
+        report = []
+        for name in (collections if collections is not None else INDEXES.keys()):
+            if not self.has_collection(name):
+                continue
+            col = self.db[name]
+            for index in INDEXES.get(name, []):
+                start = time.perf_counter()
+                try:
+                    col.create_indexes([index])
+                except Exception as e:
+                    logging.critical(f'An error occured in ensure_indexes() -> \n{e}')
+                    continue
+                report.append({'collection': name, 'index': index.document['name'], 'seconds': time.perf_counter() - start})
+            sizes = self.index_sizes(name)
+            for row in report:
+                if row['collection'] == name:
+                    row['size'] = sizes.get(row['index'])
+        for row in report:
+            logging.info(f'Index {row["collection"]}.{row["index"]}: built in {row["seconds"]:.3f}s, size {row["size"]} bytes')
+        return report
+
+    def drop_indexes(self, collections : Optional[Iterable[str]] = None) -> list[str]:
+        """
+        Drops the standard secondary indexes (INDEXES), e.g. before a bulk load. Other indexes and _id are left alone.
+        :param collections: The collections to drop indexes of (None = all collections in INDEXES)
+        :returns: The dropped indexes as collection.index
+        """
+        dropped = []
+        for name in (collections if collections is not None else INDEXES.keys()):
+            if not self.has_collection(name):
+                continue
+            col = self.db[name]
+            existing = col.index_information()
+            for index in INDEXES.get(name, []):
+                if index.document['name'] not in existing:
+                    continue
+                try:
+                    col.drop_index(index.document['name'])
+                except Exception as e:
+                    logging.critical(f'An error occured in drop_indexes() -> \n{e}')
+                    continue
+                dropped.append(f'{name}.{index.document["name"]}')
+        logging.info(f'Dropped indexes: {dropped}')
+        return dropped
+
+    def verify_counts(self, layout : str = 'point') -> dict:
+        """
+        Checks that the collections agree with each other after a load: every Activity is referenced by its User,
+        and the TrackPoints (or the points in the TrackPointBuckets) add up to the point counts of the Activities
+        :param layout: The TrackPoint layout the data was loaded with ('point' or 'bucket')
+        :returns: The counts and whether they match ('ok')
+        """
+        def total(collection : str, group : dict) -> int:
+            results = list(self.db[collection].aggregate([{'$group': {'_id': None, 'total': group}}]))
+            return results[0]['total'] if results else 0
+
+        counts = {'users': self.db.User.count_documents({}),
+                  'activities': self.db.Activity.count_documents({}),
+                  'user_activities': total('User', {'$sum': {'$size': '$activities'}}),
+                  'activity_points': total('Activity', {'$sum': '$point_count'})}
+        if layout == 'bucket':
+            counts['trackpoints'] = total('TrackPointBucket', {'$sum': '$count'})
+        else:
+            counts['trackpoints'] = self.db.TrackPoint.count_documents({})
+        counts['ok'] = counts['activities'] == counts['user_activities'] and counts['trackpoints'] == counts['activity_points']
+        if not counts['ok']:
+            logging.critical(f'The loaded counts do not match: {counts}')
+        return counts
+
+    def index_sizes(self, collection : str) -> dict[str, int]:
+        """
+        Gets the size of every index of a collection
+        :param collection: The name of the collection
+        :returns: The index sizes in bytes keyed by index name
+        """
+        try:
+            return self.db.command('collStats', collection).get('indexSizes', {})
+        except Exception as e:
+            logging.critical(f'An error occured in index_sizes() -> \n{e}')
+            return {}
+
+    def add_locations(self) -> bool:
+        """
+        Adds the GeoJSON location to TrackPoints that were inserted without one (valid coordinates only)
+        :returns: True if successful, False if not
+        """
+        try:
+            result = self.db.TrackPoint.update_many({'location': {'$exists': False},
+                                                     'lat': {'$gte': -90, '$lte': 90},
+                                                     'lon': {'$gte': -180, '$lte': 180}},
+                                                    [{'$set': {'location': {'type': 'Point', 'coordinates': ['$lon', '$lat']}}}])
+        except Exception as e:
+            logging.critical(f'An error occured in add_locations() -> \n{e}')
+            return False
+        logging.info(f'Added locations to {result.modified_count} TrackPoints')
+        return self.bump_generation() if result.modified_count else True # q10 may answer differently
+
+    def users_within(self, lat : float, lon : float, radius : float, filter : Optional[dict] = None) -> list[str]:
+        """
+        Finds the users that have at least one TrackPoint within a distance of a point (answered by the 2dsphere index)
+        :param lat: The latitude of the point
+        :param lon: The longitude of the point
+        :param radius: The distance in meters
+        :param filter: An additional filter on the TrackPoints (e.g. a range of users)
+        :returns: The distinct IDs of the users
+        """
+        return self.db.TrackPoint.distinct('activity.user',
+                                           {
+                                               'location':
+                                               {
+                                                   '$geoWithin': {'$centerSphere': [[lon, lat], radius / EARTH_RADIUS_METERS]}
+                                               },
+                                               **(filter or {})
+                                           })
+
+    def id_ranges(self, collection : str, parts : int, filter : Optional[dict] = None) -> list[tuple]:
+        """
+        Splits the _ids of a collection into contiguous ranges with about the same number of documents, for partitioned queries
+        :param collection: The name of the collection (e.g. 'User' for ranges of user IDs)
+        :param parts: The maximum number of ranges
+        :param filter: Only split the documents that match this filter
+        :returns: (low, high) ranges where low is inclusive and high exclusive (None = unbounded)
+        """
+        ids = [document['_id'] for document in self.db[collection].find(filter or {}, {'_id': 1}).sort('_id', ASCENDING)]
+        if not ids:
+            return [(None, None)]
+        size = -(-len(ids) // parts)
+        lows = ids[::size]
+        return [(None if i == 0 else low, lows[i + 1] if i + 1 < len(lows) else None) for i, low in enumerate(lows)]
+
+    def activity_trackpoints(self,
+                             activity : ObjectId,
+                             start : int = 0,
+                             stop : Optional[int] = None,
+                             projection : Optional[dict] = None) -> Iterator[dict]:
+        """
+        Reads a range of the TrackPoints of an activity in order (one index range scan on activity_seq)
+        :param activity: The ID of the activity
+        :param start: The seq of the first TrackPoint
+        :param stop: The seq after the last TrackPoint (None = until the end of the activity)
+        :param projection: The fields to return
+        :returns: The TrackPoints in seq order
+        """
+        seq = {'$gte': start} if stop is None else {'$gte': start, '$lt': stop}
+        return self.db.TrackPoint.find({'activity._id': activity, 'seq': seq}, projection).sort('seq', ASCENDING)
+
+    def add_sequences(self) -> bool:
+        """
+        Numbers the TrackPoints of every activity by _id (the insertion order), for data loaded before TrackPoints had a seq
+        :returns: True if successful, False if not
+        """
+        try:
+            self.db.TrackPoint.aggregate([
+                {
+                    '$match': {'seq': None}
+                },
+                {
+                    '$setWindowFields':
+                    {
+                        'partitionBy': '$activity._id',
+                        'sortBy': {'_id': 1},
+                        'output': {'seq': {'$documentNumber': {}}}
+                    }
+                },
+                {
+                    '$project': {'seq': {'$subtract': ['$seq', 1]}}
+                },
+                {
+                    '$merge': {'into': 'TrackPoint', 'on': '_id', 'whenMatched': 'merge', 'whenNotMatched': 'discard'}
+                }
+            ], allowDiskUse=True)
+        except Exception as e:
+            logging.critical(f'An error occured in add_sequences() -> \n{e}')
+            return False
+        logging.info('Added sequence numbers to the TrackPoints')
+        return self.bump_generation() # The TrackPoints of an activity are now ordered by seq
+
+    def trackpoints_by_activity(self,
+                                activities : list[ObjectId],
+                                filter : Optional[dict] = None,
+                                projection : Optional[dict] = None,
+                                chunk_size : int = 100) -> Iterator[tuple[ObjectId, list[dict]]]:
+        """
+        Fetches the TrackPoints of many activities with one query per chunk of activities instead of one query per activity
+        :param activities: The IDs of the activities
+        :param filter: An additional filter on the TrackPoints (e.g. a date_time range)
+        :param projection: The fields to return (activity._id is always included)
+        :param chunk_size: The number of activities per query
+        :returns: (activity ID, TrackPoints in seq order) for every activity that has matching TrackPoints
+        """
+        if projection is not None:
+            projection = {**projection, 'activity._id': 1}
+        for i in range(0, len(activities), chunk_size):
+            query = {'activity._id': {'$in': activities[i:i + chunk_size]}, **(filter or {})}
+            trackpoints = self.db.TrackPoint.find(query, projection).sort([('activity._id', ASCENDING), ('seq', ASCENDING)]) # One index range scan per activity
+            for activity, points in groupby(trackpoints, key=lambda trackpoint: trackpoint['activity']['_id']):
+                yield activity, list(points)
+
+    def trackpoint_columns(self,
+                           fields : Iterable[str] = ('lat', 'lon'),
+                           filter : Optional[dict] = None,
+                           ordered : bool = True,
+                           batch_size : int = 100000,
+                           codes : Optional[dict] = None) -> Iterator[dict[str, np.ndarray]]:
+        """
+        Streams TrackPoints as columnar NumPy arrays. The raw BSON batches of a projected cursor are decoded straight into arrays
+        by BsonColumns.decode_columns() (batches whose documents differ in layout fall back to bson.decode_all).
+        Memory use is bounded by the batch size.
+        :param fields: The top-level numeric fields to read ('date_time' is returned as datetime64[ms])
+        :param filter: A filter on the TrackPoints
+        :param ordered: Sort by (activity._id, seq), number the activities and never split an activity across two batches
+        :param batch_size: The number of documents per batch
+        :param codes: The activity codes (Activity ID -> code), filled in while streaming so the codes can be mapped back to Activities (ordered only)
+        :returns: Batches of columns keyed by field name, plus 'user' and (if ordered) 'activity' (an int code per activity)
+        """
+        projection = {'_id': 0, 'activity.user': 1, **{field : 1 for field in fields}}
+        sort = None
+        if ordered:
+            projection['activity._id'] = 1
+            sort = [('activity._id', ASCENDING), ('seq', ASCENDING)]
+        codes = {} if codes is None else codes
+        carry = None
+        for batch in self.db.TrackPoint.find_raw_batches(filter or {}, projection, sort=sort, batch_size=batch_size):
+            columns = self._batch_columns(batch, fields, ordered)
+            if carry is not None:
+                columns = {name : np.concatenate([carry[name], column]) for name, column in columns.items()}
+                carry = None
+            if ordered and len(columns['user']): # Hold back the last activity, it may continue in the next batch
+                ids = columns['activity_id']
+                split = (ids != ids[-1]).any(axis=1).nonzero()[0]
+                split = split[-1] + 1 if len(split) else 0
+                carry = {name : column[split:] for name, column in columns.items()}
+                columns = {name : column[:split] for name, column in columns.items()}
+            if len(columns['user']):
+                yield self._activity_codes(columns, codes) if ordered else columns
+        if carry is not None and len(carry['user']):
+            yield self._activity_codes(carry, codes)
+
+    @staticmethod
+    def _batch_columns(batch : bytes, fields : Iterable[str], ordered : bool) -> dict[str, np.ndarray]:
+        """
+        Decodes a raw batch of projected TrackPoints to columns ('activity_id' holds the 12 bytes of each Activity ID if ordered)
+        """
+        decoded = decode_columns(batch)
+        if decoded is not None and all(field in decoded for field in fields):
+            try:
+                columns = {'user': decoded['activity.user'].astype(str)} # ASCII user IDs, a single C cast
+            except UnicodeDecodeError:
+                columns = {'user': np.char.decode(decoded['activity.user'], 'utf-8')}
+            if ordered:
+                columns['activity_id'] = decoded['activity._id']
+            for field in fields:
+                columns[field] = decoded[field] if field == 'date_time' else decoded[field].astype(np.float64, copy=False)
+            return columns
+
+        documents = bson.decode_all(batch)
+        columns = {'user': np.array([document['activity']['user'] for document in documents], dtype=str)}
+        if ordered:
+            columns['activity_id'] = np.frombuffer(b''.join(document['activity']['_id'].binary for document in documents), np.uint8).reshape(-1, 12)
+        for field in fields:
+            if field == 'date_time':
+                columns[field] = np.array([document[field] for document in documents], dtype='datetime64[ms]')
+            else:
+                columns[field] = np.fromiter((document[field] for document in documents), np.float64, len(documents))
+        return columns
+
+    @staticmethod
+    def _activity_codes(columns : dict[str, np.ndarray], codes : dict) -> dict[str, np.ndarray]:
+        """
+        Replaces the Activity IDs of ordered columns by an int code per activity (one Python call per activity, not per point)
+        """
+        ids = columns.pop('activity_id')
+        starts = np.flatnonzero(np.concatenate(([True], (ids[1:] != ids[:-1]).any(axis=1))))
+        run_codes = [codes.setdefault(ObjectId(ids[start].tobytes()), len(codes)) for start in starts]
+        columns['activity'] = np.repeat(np.array(run_codes, np.int64), np.diff(np.append(starts, len(ids))))
+        return columns
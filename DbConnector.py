@@ -1,13 +1,82 @@
 from pymongo import MongoClient, version
 from dotenv import load_dotenv
+from importlib.util import find_spec
 import os
 
 load_dotenv()
 
+# Wire compression, best first. zstd and snappy need optional packages, zlib is always available
+COMPRESSORS = ','.join([name for name, module in (('zstd', 'zstandard'), ('snappy', 'snappy')) if find_spec(module)] + ['zlib'])
+
+# Connection settings per workload. Every setting can be overridden with MONGO_<PROFILE>_<SETTING> or MONGO_<SETTING>, e.g. MONGO_INGEST_POOL_SIZE=4
+PROFILES = {
+    'default': {},
+    'ingest': {
+        'maxPoolSize': 10,
+        'compressors': COMPRESSORS, # The server picks the first one it supports
+        'serverSelectionTimeoutMS': 30000,
+        'socketTimeoutMS': 120000,
+        'readPreference': 'primary',
+    },
+    'analytics': {
+        'maxPoolSize': 50,
+        'compressors': COMPRESSORS,
+        'serverSelectionTimeoutMS': 10000,
+        'socketTimeoutMS': 0, # No timeout, some aggregations run for minutes
+        'readPreference': 'secondaryPreferred',
+    },
+}
+SETTINGS = {
+    'maxPoolSize': ('POOL_SIZE', int),
+    'compressors': ('COMPRESSORS', str),
+    'serverSelectionTimeoutMS': ('SERVER_SELECTION_TIMEOUT_MS', int),
+    'socketTimeoutMS': ('SOCKET_TIMEOUT_MS', int),
+    'readPreference': ('READ_PREFERENCE', str),
+}
+
+_clients = {} # Shared clients of this process, keyed by (pid, uri, options)
+
+def client_options(profile : str = 'default', **overrides) -> dict:
+    """
+    Resolves the MongoClient options of a profile (profile defaults < environment < overrides)
+    :param profile: The name of the profile ('default', 'ingest' or 'analytics')
+    :param overrides: MongoClient options that take precedence
+    :returns: The MongoClient options
+    """
+    options = dict(PROFILES[profile])
+    for option, (name, cast) in SETTINGS.items():
+        value = os.environ.get(f'MONGO_{profile.upper()}_{name}', os.environ.get(f'MONGO_{name}'))
+        if value is not None:
+            options[option] = cast(value)
+    options.update(overrides)
+    return options
+
+def client_key(uri : str, options : dict) -> tuple:
+    """
+    The key of a shared client (lists such as event_listeners are keyed by the identity of their items)
+    """
+    items = tuple(sorted((name, tuple(map(id, value)) if isinstance(value, list) else value) for name, value in options.items()))
+    return (os.getpid(), uri, items)
+
+def get_client(uri : str, **options) -> MongoClient:
+    """
+    Gets the shared MongoClient for a URI and set of options, creating it on first use.
+    Clients are never shared across processes (a forked child creates its own).
+    :param uri: The connection string
+    :param options: The MongoClient options
+    :returns: The client
+    """
+    key = client_key(uri, options)
+    if key not in _clients:
+        _clients[key] = MongoClient(uri, **options)
+    return _clients[key]
+
 class DbConnector:
     """
     Connects to the MongoDB server on the Ubuntu virtual machine.
-    Connector needs HOST, USER and PASSWORD to connect.
+    Connector needs HOST, USER and PASSWORD to connect. They are read from MONGO_HOST, MONGO_USER, MONGO_PASS
+    and MONGO_NAME when the connector is created (not at import) unless they are passed in.
+    Connectors with the same settings share one pooled MongoClient per process.
 
     Example:
     HOST = "tdt4225-00.idi.ntnu.no" // Your server IP address/domain name
@@ -16,14 +85,21 @@ class DbConnector:
     """
 
     def __init__(self,
-                 DATABASE=os.environ['MONGO_NAME'],
-                 HOST=os.environ['MONGO_HOST'],
-                 USER=os.environ['MONGO_USER'],
-                 PASSWORD=os.environ['MONGO_PASS']):
-        uri = "mongodb://%s:%s@%s/%s" % (USER, PASSWORD, HOST, DATABASE)
+                 DATABASE=None,
+                 HOST=None,
+                 USER=None,
+                 PASSWORD=None,
+                 profile='default',
+                 **options):
+        DATABASE = DATABASE or os.environ['MONGO_NAME']
+        HOST = HOST or os.environ['MONGO_HOST']
+        USER = USER or os.environ['MONGO_USER']
+        PASSWORD = PASSWORD or os.environ['MONGO_PASS']
+        self.uri = "mongodb://%s:%s@%s/%s" % (USER, PASSWORD, HOST, DATABASE)
+        self.options = client_options(profile, **options)
         # Connect to the databases
         try:
-            self.client = MongoClient(uri)
+            self.client = get_client(self.uri, **self.options)
             self.db = self.client[DATABASE]
         except Exception as e:
             print("ERROR: Failed to connect to db:", e)
@@ -34,7 +110,8 @@ class DbConnector:
 
     def close_connection(self):
         # close the cursor
-        # close the DB connection
+        # close the DB connection (the shared client is closed for every connector using it)
+        _clients.pop(client_key(self.uri, self.options), None)
         self.client.close()
         print("\n-----------------------------------------------")
         print("Connection to %s-db is closed" % self.db.name)
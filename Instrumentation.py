@@ -0,0 +1,142 @@
+from pymongo import monitoring
+from contextlib import contextmanager
+from tabulate import tabulate
+from typing import Iterator, Optional
+import bson
+import json
+import threading
+
+def _count_documents(batch : list) -> int:
+    """
+    Counts the documents of a cursor batch. The batches of raw-batch cursors (find_raw_batches, aggregate_raw_batches) hold
+    the concatenated BSON documents as one bytes element, those are counted by walking the length prefixes.
+    """
+    documents = 0
+    for element in batch:
+        if not isinstance(element, bytes):
+            documents += 1
+            continue
+        pos = 0
+        while pos + 4 <= len(element):
+            pos += int.from_bytes(element[pos:pos + 4], 'little')
+            documents += 1
+    return documents
+
+class CommandRecorder(monitoring.CommandListener, monitoring.ConnectionPoolListener):
+    """
+    Records every command sent to the server (latency, collection, documents and bytes returned) and counts connection pool events.
+    Commands are attributed to the phase (e.g. a part2 question or a part1 stage) that is active in the thread that sent them.
+    Only registered on clients created with Database(instrument=True), so it costs nothing when instrumentation is off.
+
+    Example:
+    db = Database(instrument=True)
+    with db.recorder.phase('q7'):
+        q7(db)
+    print(db.recorder.table())
+    """
+    def __init__(self) -> None:
+        self.records = []
+        self.pool_events = {}
+        self._pending = {}
+        self._cursors = {} # Cursor ID -> the command that opened the cursor
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def phase(self, name : str) -> Iterator[None]:
+        """
+        Attributes the commands of the current thread to a phase
+        :param name: The name of the phase
+        """
+        previous = getattr(self._local, 'phase', None)
+        self._local.phase = name
+        try:
+            yield
+        finally:
+            self._local.phase = previous
+
+    def current_phase(self) -> Optional[str]:
+        """
+        The phase of the current thread, e.g. to enter it again on a worker thread
+        :returns: The name of the phase (None outside of a phase)
+        """
+        return getattr(self._local, 'phase', None)
+
+    def started(self, event : monitoring.CommandStartedEvent) -> None:
+        command = event.command_name
+        collection = event.command.get(command)
+        with self._lock:
+            if command == 'getMore': # Attributed to the find/aggregate that opened the cursor
+                command = self._cursors.get(event.command.get('getMore'), command)
+                collection = event.command.get('collection')
+            self._pending[(event.connection_id, event.request_id)] = (self.current_phase(), command, collection if isinstance(collection, str) else None, event.command.get('getMore'))
+
+    def succeeded(self, event : monitoring.CommandSucceededEvent) -> None:
+        cursor = event.reply.get('cursor', {})
+        documents = _count_documents(cursor.get('firstBatch', cursor.get('nextBatch', []))) if cursor else len(event.reply.get('values', []))
+        self._record(event, documents, len(bson.encode(event.reply)), None, cursor.get('id', 0) if cursor else 0)
+
+    def failed(self, event : monitoring.CommandFailedEvent) -> None:
+        self._record(event, 0, 0, str(event.failure), 0)
+
+    def _record(self, event, documents : int, reply_bytes : int, error, cursor_id : int) -> None:
+        with self._lock:
+            phase, command, collection, get_more = self._pending.pop((event.connection_id, event.request_id), (None, event.command_name, None, None))
+            if cursor_id:
+                self._cursors[cursor_id] = command
+            elif get_more is not None: # The cursor is exhausted
+                self._cursors.pop(get_more, None)
+            self.records.append({'phase': phase,
+                                 'command': command,
+                                 'collection': collection,
+                                 'getMore': event.command_name == 'getMore',
+                                 'ms': event.duration_micros / 1000,
+                                 'documents': documents,
+                                 'bytes': reply_bytes,
+                                 'error': error})
+
+    def _count(self, event) -> None:
+        with self._lock:
+            name = type(event).__name__
+            self.pool_events[name] = self.pool_events.get(name, 0) + 1
+
+    # Connection pool events are only counted
+    pool_created = pool_ready = pool_cleared = pool_closed = _count
+    connection_created = connection_ready = connection_closed = _count
+    connection_check_out_started = connection_check_out_failed = connection_checked_out = connection_checked_in = _count
+
+    def report(self) -> list[dict]:
+        """
+        Summarizes the recorded commands per phase, command and collection
+        :returns: One row per (phase, command, collection) with count, total/max latency, documents, bytes and getMores
+        """
+        rows = {}
+        with self._lock:
+            records = list(self.records)
+        for record in records:
+            key = (record['phase'], record['command'], record['collection'])
+            row = rows.setdefault(key, {'phase': key[0], 'command': key[1], 'collection': key[2], 'count': 0, 'getMores': 0,
+                                        'total_ms': 0.0, 'max_ms': 0.0, 'documents': 0, 'bytes': 0, 'errors': 0})
+            row['count'] += 1
+            row['getMores'] += record['getMore']
+            row['total_ms'] += record['ms']
+            row['max_ms'] = max(row['max_ms'], record['ms'])
+            row['documents'] += record['documents']
+            row['bytes'] += record['bytes']
+            row['errors'] += record['error'] is not None
+        return list(rows.values())
+
+    def table(self) -> str:
+        """
+        Formats the report as a table
+        :returns: The table
+        """
+        return tabulate(self.report(), headers='keys', floatfmt='.2f')
+
+    def dump(self, path : str) -> None:
+        """
+        Writes the report and the pool event counts as JSON
+        :param path: The path of the JSON file
+        """
+        with open(path, 'w') as f:
+            json.dump({'commands': self.report(), 'pool_events': self.pool_events}, f, indent=2)
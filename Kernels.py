@@ -0,0 +1,117 @@
+import numpy as np
+
+EARTH_RADIUS_KILOMETERS = 6371.0088 # The mean earth radius, same as the haversine package
+INVALID_ALTITUDE = -777
+
+def haversine_distances(lat : np.ndarray, lon : np.ndarray) -> np.ndarray:
+    """
+    Computes the distance between every pair of consecutive points
+    :param lat: The latitudes of the points
+    :param lon: The longitudes of the points
+    :returns: The len(lat) - 1 distances in kilometers
+    """
+    lat, lon = np.radians(lat), np.radians(lon)
+    dlat = np.diff(lat)
+    dlon = np.diff(lon)
+    a = np.sin(dlat * 0.5) ** 2 + np.cos(lat[:-1]) * np.cos(lat[1:]) * np.sin(dlon * 0.5) ** 2
+    return 2 * EARTH_RADIUS_KILOMETERS * np.arcsin(np.sqrt(a))
+
+def path_length(lat : np.ndarray, lon : np.ndarray) -> float:
+    """
+    Computes the length of a path
+    :param lat: The latitudes of the points
+    :param lon: The longitudes of the points
+    :returns: The length in kilometers
+    """
+    if len(lat) < 2:
+        return 0.0
+    return float(haversine_distances(lat, lon).sum())
+
+def altitude_gain(altitude : np.ndarray) -> float:
+    """
+    Computes the gross altitude gain (the sum of all positive deltas) of a path, ignoring invalid (-777) altitudes
+    :param altitude: The altitudes of the points
+    :returns: The gain in the unit of the altitudes
+    """
+    altitude = altitude[altitude != INVALID_ALTITUDE]
+    deltas = np.diff(altitude)
+    return float(deltas[deltas > 0].sum())
+
+def max_gap(date_time : np.ndarray) -> float:
+    """
+    Computes the largest time difference between two consecutive points
+    :param date_time: The times of the points as datetime64
+    :returns: The gap in seconds (0 for fewer than two points)
+    """
+    if len(date_time) < 2:
+        return 0.0
+    return float(np.diff(date_time).max() / np.timedelta64(1, 's'))
+
+def bounding_box(lat : np.ndarray, lon : np.ndarray) -> dict:
+    """
+    Computes the bounding box of a set of points
+    :param lat: The latitudes of the points
+    :param lon: The longitudes of the points
+    :returns: The box as {'min_lat', 'min_lon', 'max_lat', 'max_lon'}
+    """
+    return {'min_lat': float(lat.min()), 'min_lon': float(lon.min()), 'max_lat': float(lat.max()), 'max_lon': float(lon.max())}
+
+def segment_starts(segments : np.ndarray) -> np.ndarray:
+    """
+    Finds the rows where a new segment (e.g. activity) begins in an array of segment codes sorted by segment
+    :param segments: The segment code of every row
+    :returns: A boolean mask that is True for the first row of every segment
+    """
+    starts = np.ones(len(segments), dtype=bool)
+    starts[1:] = segments[1:] != segments[:-1]
+    return starts
+
+def segment_positive_deltas(values : np.ndarray, segments : np.ndarray) -> np.ndarray:
+    """
+    Computes the positive difference from the previous value of the same segment for every value
+    :param values: The values (e.g. altitudes)
+    :param segments: The segment code of every value (sorted by segment)
+    :returns: The positive deltas (0 for decreases and for the first value of a segment)
+    """
+    deltas = np.zeros(len(values))
+    if len(values) > 1:
+        deltas[1:] = np.diff(values)
+    deltas[segment_starts(segments)] = 0
+    return np.clip(deltas, 0, None)
+
+def segment_gaps(date_time : np.ndarray, segments : np.ndarray) -> np.ndarray:
+    """
+    Computes the time since the previous point of the same segment for every point
+    :param date_time: The times of the points as datetime64
+    :param segments: The segment code of every point (sorted by segment)
+    :returns: The gaps in seconds (0 for the first point of a segment)
+    """
+    gaps = np.zeros(len(date_time))
+    if len(date_time) > 1:
+        gaps[1:] = np.diff(date_time) / np.timedelta64(1, 's')
+    gaps[segment_starts(segments)] = 0
+    return gaps
+
+def haversine_to(lat : np.ndarray, lon : np.ndarray, point : tuple[float, float]) -> np.ndarray:
+    """
+    Computes the distance from every point to a single point
+    :param lat: The latitudes of the points
+    :param lon: The longitudes of the points
+    :param point: The (lat, lon) of the single point
+    :returns: The distances in kilometers
+    """
+    lat, lon = np.radians(lat), np.radians(lon)
+    point_lat, point_lon = np.radians(point[0]), np.radians(point[1])
+    a = np.sin((lat - point_lat) * 0.5) ** 2 + np.cos(lat) * np.cos(point_lat) * np.sin((lon - point_lon) * 0.5) ** 2
+    return 2 * EARTH_RADIUS_KILOMETERS * np.arcsin(np.sqrt(a))
+
+def group_sum(keys : np.ndarray, values : np.ndarray) -> dict:
+    """
+    Sums values per key
+    :param keys: The key of every value
+    :param values: The values
+    :returns: The sums keyed by key
+    """
+    names, inverse = np.unique(keys, return_inverse=True)
+    sums = np.bincount(inverse.ravel(), weights=values, minlength=len(names))
+    return dict(zip(names.tolist(), sums.tolist()))
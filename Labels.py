@@ -0,0 +1,90 @@
+from datetime import datetime, timedelta
+from bisect import bisect_right
+from pathlib import Path
+from typing import Optional, Union
+
+LABEL_FORMAT = '%Y/%m/%d %H:%M:%S'
+
+class LabelIndex:
+    """
+    An index over the labels (start, end, transportation mode) of a single user.
+    Exact matches are a hash lookup on (start, end), tolerant matches use an interval index sorted by start time.
+    """
+    def __init__(self, labels : list[tuple[datetime, datetime, str]]) -> None:
+        """
+        Initialize the index
+        :param labels: The labels as (start, end, transportation mode) in file order
+        """
+        self.exact_index = {}
+        for start, end, mode in labels:
+            self.exact_index.setdefault((start, end), mode) # The first label in the file wins, like the linear scan did
+
+        self.intervals = sorted(labels, key=lambda label: label[0])
+        self.starts = [label[0] for label in self.intervals]
+        self.max_ends = [] # The latest end time of any interval up to (and including) index i
+        for _, end, _ in self.intervals:
+            self.max_ends.append(end if not self.max_ends else max(self.max_ends[-1], end))
+
+    @classmethod
+    def from_file(cls, path : Union[str, Path]) -> 'LabelIndex':
+        """
+        Reads a labels.txt file in a single pass
+        :param path: The path of the labels.txt file
+        :returns: The index of the labels
+        """
+        labels = []
+        with open(path, 'r') as f:
+            lines = f.readlines()
+        for line in lines[1:]:
+            label = line.split()
+            if len(label) < 5:
+                continue
+            start = datetime.strptime(f'{label[0]} {label[1]}', LABEL_FORMAT)
+            end = datetime.strptime(f'{label[2]} {label[3]}', LABEL_FORMAT)
+            labels.append((start, end, label[4]))
+        return cls(labels)
+
+    def __len__(self) -> int:
+        return len(self.intervals)
+
+    def exact(self, start : datetime, end : datetime) -> Optional[str]:
+        """
+        Finds the transportation mode of a label with exactly the same start and end time
+        :param start: The start time of the activity
+        :param end: The end time of the activity
+        :returns: The transportation mode, None if there is no such label
+        """
+        return self.exact_index.get((start, end))
+
+    def overlapping(self, start : datetime, end : datetime, tolerance : timedelta = timedelta(0)) -> Optional[str]:
+        """
+        Finds the transportation mode of the label that overlaps the activity the most
+        :param start: The start time of the activity
+        :param end: The end time of the activity
+        :param tolerance: How far the label may lie outside of the activity and still count as overlapping
+        :returns: The transportation mode, None if no label overlaps
+        """
+        best_mode = None
+        best_overlap = None
+        i = bisect_right(self.starts, end + tolerance) - 1
+        while i >= 0 and self.max_ends[i] >= start - tolerance:
+            label_start, label_end, mode = self.intervals[i]
+            if label_end >= start - tolerance:
+                overlap = min(end, label_end) - max(start, label_start)
+                if best_overlap is None or overlap > best_overlap:
+                    best_mode, best_overlap = mode, overlap
+            i -= 1
+        return best_mode
+
+    def lookup(self, start : datetime, end : datetime, tolerance : Optional[timedelta] = None) -> Optional[str]:
+        """
+        Exact lookup, falling back to the interval index if a tolerance is given
+        :param start: The start time of the activity
+        :param end: The end time of the activity
+        :param tolerance: The tolerance for overlapping matches (None = exact matches only)
+        :returns: The transportation mode, None if no label matches
+        """
+        mode = self.exact(start, end)
+        if mode is None and tolerance is not None:
+            mode = self.overlapping(start, end, tolerance)
+        return mode
@@ -0,0 +1,145 @@
+from datetime import datetime
+from pathlib import Path
+from typing import Optional, Union
+import numpy as np
+import os
+import warnings
+
+PLT_HEADER_LINES = 6
+MAX_POINTS = 2500          # Trajectories with more points are not loaded (part1 and ColumnStore.from_plt)
+SCAN_CHUNK_BYTES = 1 << 16 # Read size of the newline counting
+TAIL_BYTES = 256           # Enough for the last point line
+PLT_DTYPE = np.dtype([('lat', 'f8'),
+                      ('lon', 'f8'),
+                      ('zero', 'f8'),
+                      ('altitude', 'f8'),
+                      ('date_days', 'f8'),
+                      ('date', 'U10'),
+                      ('time', 'U8')])
+
+class PltColumns:
+    """
+    The points of a single .plt trajectory file stored as parallel (columnar) NumPy arrays.
+    """
+    def __init__(self,
+                 lat : np.ndarray,
+                 lon : np.ndarray,
+                 altitude : np.ndarray,
+                 date_days : np.ndarray,
+                 date_time : np.ndarray) -> None:
+        """
+        Initialize the columns of a trajectory
+        :param lat: The latitudes of the points
+        :param lon: The longitudes of the points
+        :param altitude: The altitudes of the points (feet, -777 if invalid)
+        :param date_days: The times in decimal number of days
+        :param date_time: The times as datetime64[s]
+        """
+        self.lat = lat
+        self.lon = lon
+        self.altitude = altitude
+        self.date_days = date_days
+        self.date_time = date_time
+
+    def __len__(self) -> int:
+        return len(self.lat)
+
+    def datetimes(self) -> list[datetime]:
+        """
+        Converts the date_time column to python datetimes in one pass
+        :returns: A list of datetimes
+        """
+        return self.date_time.tolist()
+
+class PltInfo:
+    """
+    The pre-scan of a single .plt trajectory file: what the loader needs to know before parsing it.
+    """
+    def __init__(self,
+                 path : Path,
+                 size : int,
+                 points : int,
+                 start : Optional[datetime],
+                 end : Optional[datetime]) -> None:
+        """
+        Initialize the pre-scan of a trajectory
+        :param path: The path of the .plt file
+        :param size: The size of the file in bytes
+        :param points: The number of points (a lower bound above the limit the file was scanned with)
+        :param start: The time of the first point (None if the file has no points)
+        :param end: The time of the last point (None if the file has no points)
+        """
+        self.path = path
+        self.size = size
+        self.points = points
+        self.start = start
+        self.end = end
+
+    def __repr__(self) -> str:
+        return f'PltInfo({self.path.name}, points={self.points}, start={self.start}, end={self.end})'
+
+def _count_lines(f, limit : Optional[int]) -> tuple[int, bytes, bytes]:
+    """
+    Counts the point lines of an open .plt file in buffered binary chunks, without decoding or splitting lines
+    :param f: The file, opened in binary mode
+    :param limit: Stop reading as soon as the file has more points than this (None = count every point)
+    :returns: The number of points, the first chunk and the last TAIL_BYTES read (empty if stopped at the limit)
+    """
+    stop = None if limit is None else PLT_HEADER_LINES + limit
+    lines = 0
+    head = tail = b''
+    while chunk := f.read(SCAN_CHUNK_BYTES):
+        head = head or chunk
+        lines += chunk.count(b'\n')
+        tail = (tail + chunk)[-TAIL_BYTES:]
+        if stop is not None and lines > stop:
+            return lines - PLT_HEADER_LINES, head, b''
+    if tail and tail[-1:] != b'\n': # The last line has no newline
+        lines += 1
+    return max(lines - PLT_HEADER_LINES, 0), head, tail
+
+def _point_time(line : bytes) -> datetime:
+    """
+    Parses the time of a point line (the last two fields)
+    """
+    date, time = line.decode().strip().split(',')[-2:]
+    return datetime.fromisoformat(f'{date} {time}')
+
+def scan_plt(path : Union[str, Path], limit : Optional[int] = None) -> PltInfo:
+    """
+    Pre-scans a .plt file in a single pass: its size, number of points and the times of the first and last point
+    (taken from the first and last bytes read; only a file that exceeds the limit is read again at its end)
+    :param path: The path of the .plt file
+    :param limit: Stop counting points above this limit (None = count every point)
+    :returns: The pre-scan of the file
+    """
+    path = Path(path)
+    size = os.path.getsize(path)
+    with open(path, 'rb') as f:
+        points, head, tail = _count_lines(f, limit)
+        if points == 0:
+            return PltInfo(path, size, 0, None, None)
+        if not tail:
+            f.seek(max(size - TAIL_BYTES, 0))
+            tail = f.read()
+    start = _point_time(head.split(b'\n', PLT_HEADER_LINES + 1)[PLT_HEADER_LINES])
+    end = _point_time([line for line in tail.splitlines() if line.strip()][-1])
+    return PltInfo(path, size, points, start, end)
+
+def parse_plt(path : Union[str, Path]) -> PltColumns:
+    """
+    Parses a whole .plt file in one batched pass instead of splitting and strptime'ing every line
+    :param path: The path of the .plt file
+    :returns: The columns of the trajectory
+    """
+    with open(path, 'r') as f, warnings.catch_warnings():
+        warnings.filterwarnings('ignore', message='loadtxt: input contained no data') # Empty trajectories are skipped by the loader
+        data = np.loadtxt(f, dtype=PLT_DTYPE, delimiter=',', skiprows=PLT_HEADER_LINES, ndmin=1)
+
+    # The date and time fields are fixed width (YYYY-MM-DD and HH:MM:SS), so numpy can parse them as ISO 8601 directly
+    date_time = np.char.add(np.char.add(data['date'], 'T'), data['time']).astype('datetime64[s]')
+    return PltColumns(lat=data['lat'],
+                      lon=data['lon'],
+                      altitude=data['altitude'],
+                      date_days=data['date_days'],
+                      date_time=date_time)
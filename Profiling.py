@@ -0,0 +1,165 @@
+from contextlib import contextmanager
+from tabulate import tabulate
+from typing import Iterator, Optional
+import cProfile
+import json
+import pstats
+import threading
+import time
+import tracemalloc
+
+class Profiler:
+    """
+    Opt-in profiling of the part1 and part2 entry points: wall time per named stage, an optional cProfile capture,
+    tracemalloc peaks (per stage and overall) with the top allocation sites, and the ingest throughput per user.
+    Stages can be nested and repeated, their times are summed. cProfile only sees the thread that called start(),
+    and neither cProfile nor tracemalloc see worker processes.
+
+    Example:
+    profiler = Profiler(cprofile='part1.prof', memory=True)
+    with profiler:
+        with profiler.stage('parse'):
+            parse_plt(path)
+    logging.info(profiler.table())
+    profiler.dump('profile.json')
+    """
+    def __init__(self, cprofile : Optional[str] = None, memory : bool = False, top : int = 10) -> None:
+        """
+        Initialize the profiler
+        :param cprofile: Write the cProfile statistics to this file (None = no cProfile)
+        :param memory: Trace the allocations with tracemalloc (slows Python code down considerably)
+        :param top: The number of allocation sites and functions in the report
+        """
+        self.cprofile = cprofile
+        self.memory = memory
+        self.top = top
+        self.stages = {}
+        self.users = []
+        self.peak_bytes = None
+        self.allocations = []
+        self.functions = []
+        self._active = [] # The stages that are running, with the traced memory peak seen so far
+        self._profile = None
+        self._lock = threading.Lock()
+
+    def __enter__(self) -> 'Profiler':
+        self.start()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.stop()
+
+    def start(self) -> None:
+        """
+        Starts cProfile and tracemalloc (if enabled)
+        """
+        if self.memory:
+            tracemalloc.start()
+            self.peak_bytes = 0
+        if self.cprofile:
+            self._profile = cProfile.Profile()
+            self._profile.enable()
+
+    def stop(self) -> None:
+        """
+        Stops cProfile and tracemalloc, writes the cProfile statistics and keeps the top allocation sites and functions
+        """
+        if self._profile:
+            self._profile.disable()
+            self._profile.dump_stats(self.cprofile)
+            stats = pstats.Stats(self._profile)
+            for (file, line, function), (_, calls, own, cumulative, _) in stats.stats.items():
+                self.functions.append({'function': f'{file}:{line}({function})', 'calls': calls, 'own_s': own, 'cumulative_s': cumulative})
+            self.functions = sorted(self.functions, key=lambda row: row['cumulative_s'], reverse=True)[:self.top]
+            self._profile = None
+        if self.memory and tracemalloc.is_tracing():
+            self.peak_bytes = max(self.peak_bytes or 0, tracemalloc.get_traced_memory()[1])
+            for stat in tracemalloc.take_snapshot().statistics('lineno')[:self.top]:
+                frame = stat.traceback[0]
+                self.allocations.append({'site': f'{frame.filename}:{frame.lineno}', 'bytes': stat.size, 'blocks': stat.count})
+            tracemalloc.stop()
+
+    def _update_peaks(self) -> None:
+        # Called with the lock held. The traced peak is global, so the overall peak and every running stage take it before it is reset.
+        peak = tracemalloc.get_traced_memory()[1]
+        self.peak_bytes = max(self.peak_bytes or 0, peak)
+        for frame in self._active:
+            frame[1] = max(frame[1], peak)
+        tracemalloc.reset_peak()
+
+    @contextmanager
+    def stage(self, name : str) -> Iterator[None]:
+        """
+        Times a stage (and records the traced memory peak while it runs)
+        :param name: The name of the stage
+        """
+        tracing = self.memory and tracemalloc.is_tracing()
+        frame = [name, 0]
+        if tracing:
+            with self._lock:
+                self._update_peaks()
+                self._active.append(frame)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - start
+            with self._lock:
+                if tracing:
+                    self._update_peaks()
+                    self._active.remove(frame)
+                row = self.stages.setdefault(name, {'stage': name, 'calls': 0, 'seconds': 0.0, 'peak_bytes': None})
+                row['calls'] += 1
+                row['seconds'] += seconds
+                if tracing:
+                    row['peak_bytes'] = max(row['peak_bytes'] or 0, frame[1])
+
+    def add_user(self, user : str, points : int, seconds : float) -> None:
+        """
+        Records the ingest of a user
+        :param user: The ID of the user
+        :param points: The number of TrackPoints loaded
+        :param seconds: The wall time of the load
+        """
+        with self._lock:
+            self.users.append({'user': user, 'points': points, 'seconds': seconds, 'points/s': points / seconds if seconds else 0.0})
+
+    def report(self) -> dict:
+        """
+        Summarizes the profile
+        :returns: The stages, users, memory peak, allocation sites and functions
+        """
+        with self._lock:
+            return {'stages': list(self.stages.values()),
+                    'users': sorted(self.users, key=lambda row: row['user']),
+                    'peak_bytes': self.peak_bytes,
+                    'allocations': list(self.allocations),
+                    'functions': list(self.functions),
+                    'cprofile': self.cprofile}
+
+    def table(self) -> str:
+        """
+        Formats the report as tables
+        :returns: The tables
+        """
+        report = self.report()
+        tables = [tabulate(report['stages'], headers='keys', floatfmt='.3f')]
+        if report['users']:
+            points, seconds = sum(row['points'] for row in report['users']), sum(row['seconds'] for row in report['users'])
+            tables.append(tabulate(report['users'], headers='keys', floatfmt='.1f'))
+            tables.append(f'{points} points in {seconds:.3f} user seconds ({points / seconds if seconds else 0:.1f} points/s)')
+        if report['peak_bytes'] is not None:
+            tables.append(f'Traced memory peak: {report["peak_bytes"] / 2**20:.1f} MB')
+            tables.append(tabulate(report['allocations'], headers='keys'))
+        if report['functions']:
+            tables.append(f'Top functions by cumulative time (full profile in {self.cprofile}):')
+            tables.append(tabulate(report['functions'], headers='keys', floatfmt='.3f'))
+        return '\n\n'.join(tables)
+
+    def dump(self, path : str) -> None:
+        """
+        Writes the report as JSON
+        :param path: The path of the JSON file
+        """
+        with open(path, 'w') as f:
+            json.dump(self.report(), f, indent=2)
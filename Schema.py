@@ -1,6 +1,19 @@
 from datetime import datetime
 from bson.objectid import ObjectId
-from typing import Any
+from bson.raw_bson import RawBSONDocument
+from typing import Any, Optional, Iterable, Iterator, Union
+import bson
+
+def geo_point(lat : float, lon : float) -> Optional[dict]:
+    """
+    Creates a GeoJSON point for the 2dsphere index
+    :param lat: The latitude
+    :param lon: The longitude
+    :returns: The GeoJSON point, None if the coordinates are invalid (they would be rejected by the index)
+    """
+    if not (-90 <= lat <= 90 and -180 <= lon <= 180):
+        return None
+    return {'type': 'Point', 'coordinates': [lon, lat]}
 
 class User(dict):
     """
@@ -46,7 +59,7 @@ class Activity(dict):
     """
     A custom dictionary for the Activity collection schema. Ensures consistency when inserting Activity documents.
     """
-    KEYS = ('_id', 'user', 'transportation_mode', 'start_date_time', 'end_date_time', 'trackpoints')
+    KEYS = ('_id', 'user', 'transportation_mode', 'start_date_time', 'end_date_time', 'trackpoints', 'point_count', 'distance', 'altitude_gain', 'max_gap', 'bbox')
     DENORM_KEYS = ('_id', 'user')
     def __init__(self,
                  id : ObjectId,
@@ -54,15 +67,25 @@ class Activity(dict):
                  transportation_mode : str = None,
                  start_date_time : datetime = None,
                  end_date_time : datetime = None,
-                 trackpoints : list[ObjectId] = []) -> None:
+                 trackpoints : list[ObjectId] = [],
+                 point_count : int = None,
+                 distance : float = None,
+                 altitude_gain : float = None,
+                 max_gap : float = None,
+                 bbox : dict = None) -> None:
         """
-        Initialize a Activity document
+        Initialize a Activity document. The summaries (point_count, distance, ...) are computed from the trackpoints at ingest time.
         :param id: The ID of the Activity
         :param user: The ID of the user associated with the activity (two-way reference)
         :param transportation_mode: The transportation mode of the activity
         :param start_date_time: The start time of the activity
         :param end_date_time: The end time of the activity
-        :param trackpoints: The trackpoint IDs associated with this activity
+        :param trackpoints: The trackpoint IDs associated with this activity (TrackPointBucket IDs in the bucket layout)
+        :param point_count: The number of trackpoints
+        :param distance: The haversine length of the path in kilometers
+        :param altitude_gain: The gross altitude gain in feet, excluding invalid (-777) altitudes
+        :param max_gap: The largest time difference between consecutive trackpoints in seconds
+        :param bbox: The bounding box of the trackpoints ({'min_lat', 'min_lon', 'max_lat', 'max_lon'})
         """
         super().__setitem__('_id', id)
         super().__setitem__('user', user)
@@ -70,6 +93,11 @@ class Activity(dict):
         super().__setitem__('start_date_time', start_date_time)
         super().__setitem__('end_date_time', end_date_time)
         super().__setitem__('trackpoints', trackpoints)
+        super().__setitem__('point_count', point_count)
+        super().__setitem__('distance', distance)
+        super().__setitem__('altitude_gain', altitude_gain)
+        super().__setitem__('max_gap', max_gap)
+        super().__setitem__('bbox', bbox)
         
     def __setitem__(self, key : str, item : Any) -> None:
         """
@@ -81,16 +109,16 @@ class Activity(dict):
 
     def denorm(self) -> ActivityDenorm:
         """
-        Converts the Activity to its denormalized type
+        Converts the Activity to its denormalized type. Create it once per Activity and share it between the TrackPoints.
         :returns: The denormalized Activity
         """
-        return {key : super().__getitem__(key) for key in Activity.DENORM_KEYS}
+        return ActivityDenorm((key, dict.__getitem__(self, key)) for key in Activity.DENORM_KEYS)
 
 class TrackPoint(dict):
     """
     A custom dictionary for the TrackPoint collection schema. Ensures consistency when inserting TrackPoint documents.
     """
-    KEYS = ('_id', 'lat', 'lon', 'altitude', 'date_days', 'date_time', 'activity')
+    KEYS = ('_id', 'lat', 'lon', 'altitude', 'date_days', 'date_time', 'activity', 'seq', 'location')
     def __init__(self,
                  id : ObjectId,
                  lat : float,
@@ -98,7 +126,8 @@ class TrackPoint(dict):
                  altitude : int,
                  date_days : float,
                  date_time : datetime,
-                 activity : ActivityDenorm) -> None:
+                 activity : ActivityDenorm,
+                 seq : int = None) -> None:
         """
         Initializes a TrackPoint document
         :param id: The ID of the track point
@@ -108,19 +137,133 @@ class TrackPoint(dict):
         :param date_days: The time in decimal number of days
         :param date_time: The time in datetime format
         :param activity: The activity associated with the track point (two-way reference with user field denormalized)
+        :param seq: The position of the track point within the activity (0, 1, ...)
+        """
+        super().__init__(zip(TrackPoint.KEYS, (id, lat, lon, altitude, date_days, date_time, activity, seq, geo_point(lat, lon)))) # One call, the keys come from KEYS
+
+    @staticmethod
+    def from_columns(ids : Iterable[ObjectId],
+                     lat : Iterable[float],
+                     lon : Iterable[float],
+                     altitude : Iterable[int],
+                     date_days : Iterable[float],
+                     date_time : Iterable[datetime],
+                     activity : ActivityDenorm,
+                     raw : bool = False) -> Iterator[Union['TrackPoint', RawBSONDocument]]:
+        """
+        Builds the TrackPoint documents of one activity from parallel columns (the fast path of part1), numbered by seq in column order.
+        Every document shares the same denormalized activity instead of holding its own copy.
+        :param ids: The IDs of the track points
+        :param lat: The latitudes
+        :param lon: The longitudes
+        :param altitude: The altitudes
+        :param date_days: The times in decimal number of days
+        :param date_time: The times in datetime format
+        :param activity: The denormalized activity of every track point (Activity.denorm())
+        :param raw: Encode every document to BSON right away (RawBSONDocument), the bulk insert then sends the bytes as they are
+        :returns: The documents, lazily
+        """
+        new = TrackPoint.__new__
+        for seq, values in enumerate(zip(ids, lat, lon, altitude, date_days, date_time)):
+            document = new(TrackPoint)
+            dict.__init__(document, zip(TrackPoint.KEYS, (*values, activity, seq, geo_point(values[1], values[2]))))
+            yield RawBSONDocument(bson.encode(document)) if raw else document
+
+    def __setitem__(self, key : str, item : Any) -> None:
+        """
+        Enforces restrictions on the key formatting of the TrackPoint dictionary
+        """
+        if key not in TrackPoint.KEYS:
+            raise KeyError(f"The key {key} is not defined.")
+        super().__setitem__(key, item)
+
+class TrackPointBucket(dict):
+    """
+    A custom dictionary for the TrackPointBucket collection schema. Stores a run of consecutive TrackPoints of one activity as parallel arrays.
+    """
+    KEYS = ('_id', 'activity', 'seq', 'count', 'lat', 'lon', 'altitude', 'date_days', 'date_time', 'start_date_time', 'end_date_time', 'bbox')
+    def __init__(self,
+                 id : ObjectId,
+                 activity : ActivityDenorm,
+                 seq : int,
+                 lat : list[float],
+                 lon : list[float],
+                 altitude : list[float],
+                 date_days : list[float],
+                 date_time : list[datetime]) -> None:
+        """
+        Initializes a TrackPointBucket document. The count, time range and bounding box are derived from the arrays.
+        :param id: The ID of the bucket
+        :param activity: The activity associated with the bucket (two-way reference with user field denormalized)
+        :param seq: The position of the bucket within the activity (0, 1, ...)
+        :param lat: The latitudes of the track points
+        :param lon: The longitudes of the track points
+        :param altitude: The altitudes of the track points
+        :param date_days: The times in decimal number of days
+        :param date_time: The times in datetime format
         """
         super().__setitem__('_id', id)
+        super().__setitem__('activity', activity)
+        super().__setitem__('seq', seq)
+        super().__setitem__('count', len(lat))
         super().__setitem__('lat', lat)
         super().__setitem__('lon', lon)
         super().__setitem__('altitude', altitude)
         super().__setitem__('date_days', date_days)
         super().__setitem__('date_time', date_time)
+        super().__setitem__('start_date_time', min(date_time))
+        super().__setitem__('end_date_time', max(date_time))
+        super().__setitem__('bbox', {'min_lat': min(lat), 'min_lon': min(lon), 'max_lat': max(lat), 'max_lon': max(lon)})
+
+    def __setitem__(self, key : str, item : Any) -> None:
+        """
+        Enforces restrictions on the key formatting of the TrackPointBucket dictionary
+        """
+        if key not in TrackPointBucket.KEYS:
+            raise KeyError(f"The key {key} is not defined.")
+        super().__setitem__(key, item)
+
+class ManifestEntry(dict):
+    """
+    A custom dictionary for the Manifest collection schema. Records which .plt file an Activity was loaded from.
+    """
+    KEYS = ('_id', 'user', 'size', 'mtime', 'sha1', 'layout', 'activity', 'status')
+    STATUSES = ('pending', 'done')
+    def __init__(self,
+                 path : str,
+                 user : str,
+                 size : int,
+                 mtime : int,
+                 sha1 : str,
+                 layout : str = 'point',
+                 activity : ObjectId = None,
+                 status : str = 'pending') -> None:
+        """
+        Initialize a Manifest document
+        :param path: The path of the .plt file (used as ID)
+        :param user: The ID of the user the file belongs to
+        :param size: The size of the file in bytes
+        :param mtime: The modification time of the file in nanoseconds
+        :param sha1: The SHA-1 hash of the file contents
+        :param layout: The TrackPoint layout the file was loaded with ('point' or 'bucket')
+        :param activity: The ID of the Activity loaded from the file (None if the file was skipped)
+        :param status: 'pending' while the Activity is being inserted, 'done' once it is complete
+        """
+        if status not in ManifestEntry.STATUSES:
+            raise ValueError(f"The status {status} is not defined.")
+        super().__setitem__('_id', path)
+        super().__setitem__('user', user)
+        super().__setitem__('size', size)
+        super().__setitem__('mtime', mtime)
+        super().__setitem__('sha1', sha1)
+        super().__setitem__('layout', layout)
         super().__setitem__('activity', activity)
-        
+        super().__setitem__('status', status)
+
     def __setitem__(self, key : str, item : Any) -> None:
         """
-        Enforces restrictions on the key formatting of the TrackPoint dictionary
+        Enforces restrictions on the key formatting of the ManifestEntry dictionary
         """
-        if key not in TrackPoint.KEYS:
+        if key not in ManifestEntry.KEYS:
             raise KeyError(f"The key {key} is not defined.")
         super().__setitem__(key, item)
@@ -0,0 +1,89 @@
+from Database import Database
+from bson.objectid import ObjectId
+from datetime import datetime, timedelta
+from tabulate import tabulate
+import argparse
+import bson
+import numpy as np
+import random
+import time
+
+def make_batches(points : int, batch_size : int, fields : tuple[str, ...], activity_points : int = 500) -> list[bytes]:
+    """
+    Creates raw batches of projected TrackPoints, in the field order the server returns them in
+    """
+    rng = random.Random(0)
+    start = datetime(2008, 4, 1)
+    documents = []
+    activity = None
+    for i in range(points):
+        if i % activity_points == 0:
+            activity = {'_id': ObjectId(), 'user': f'{rng.randint(0, 181):03d}'}
+        document = {'lat': 39.9 + rng.random() / 10, 'lon': 116.3 + rng.random() / 10, 'altitude': float(rng.randint(0, 300)),
+                    'date_time': start + timedelta(seconds=i), 'activity': activity}
+        documents.append({key : value for key, value in document.items() if key in fields or key == 'activity'})
+    return [b''.join(bson.encode(document) for document in documents[i:i + batch_size]) for i in range(0, points, batch_size)]
+
+def decode_dicts(batches : list[bytes], fields : tuple[str, ...]) -> list[dict]:
+    """
+    The previous read path (and what a projected cursor does): a dict per document, then a Python loop per field
+    """
+    results = []
+    codes = {}
+    for batch in batches:
+        documents = bson.decode_all(batch)
+        columns = {'user': np.array([document['activity']['user'] for document in documents])}
+        columns['activity'] = np.fromiter((codes.setdefault(document['activity']['_id'], len(codes)) for document in documents), np.int64, len(documents))
+        for field in fields:
+            columns[field] = np.fromiter((document[field] for document in documents), np.float64, len(documents))
+        results.append(columns)
+    return results
+
+def decode_arrays(batches : list[bytes], fields : tuple[str, ...]) -> list[dict]:
+    """
+    The current read path: BsonColumns.decode_columns() views the batch through one structured dtype
+    """
+    codes = {}
+    return [Database._activity_codes(Database._batch_columns(batch, fields, True), codes) for batch in batches]
+
+def bench(name : str, decode, batches : list[bytes], fields : tuple[str, ...], repeat : int) -> dict:
+    """
+    Times a decoder over the batches
+    :returns: A row for the results table
+    """
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        decode(batches, fields)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    points = sum(len(bson.decode_all(batch)) for batch in batches[:1]) * len(batches)
+    return {'decoder': name, 'fields': ','.join(fields), 'seconds': round(best, 4), 'points/s': int(points / best) if best else 0}
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark of the columnar TrackPoint read path (decoding only, or q8/q10 end to end)')
+    parser.add_argument('-n', '--points', type=int, default=1_000_000, help='Number of TrackPoints to decode')
+    parser.add_argument('-b', '--batch-size', type=int, default=100000, help='Number of documents per raw batch')
+    parser.add_argument('-r', '--repeat', type=int, default=3, help='Number of repetitions (best time is reported)')
+    parser.add_argument('--database', action='store_true', help='Also time q8/q10 against q8_columnar/q10_columnar on the database in MONGO_NAME')
+    args = parser.parse_args()
+
+    results = []
+    for fields in (('altitude',), ('lat', 'lon')): # The fields of q8_columnar and q10_columnar
+        batches = make_batches(args.points, args.batch_size, fields)
+        # Both decoders have to produce the same columns
+        for old, new in zip(decode_dicts(batches[:1], fields), decode_arrays(batches[:1], fields)):
+            assert old.keys() == new.keys() and all(np.array_equal(old[key], new[key]) for key in old), 'Decoders disagree'
+        results.append(bench('bson.decode_all + fromiter', decode_dicts, batches, fields, args.repeat))
+        results.append(bench('decode_columns', decode_arrays, batches, fields, args.repeat))
+    print(tabulate(results, headers='keys'))
+
+    if args.database:
+        import part2
+        db = Database(profile='analytics')
+        runs = []
+        for name in ('q8', 'q8_columnar', 'q10', 'q10_columnar'):
+            best = min(part2.run_query(db, name)['seconds'] for _ in range(args.repeat))
+            runs.append({'query': name, 'seconds': round(best, 3)})
+        print()
+        print(tabulate(runs, headers='keys'))
@@ -0,0 +1,62 @@
+from PltParser import parse_plt
+from pathlib import Path
+from datetime import datetime
+from tabulate import tabulate
+import argparse
+import time
+
+def parse_plt_lines(path : Path) -> list[tuple]:
+    """
+    The original line-by-line parsing loop from part1 (split + strptime per point)
+    :param path: The path of the .plt file
+    :returns: A list of (lat, lon, altitude, date_days, date_time) tuples
+    """
+    with open(path, 'r') as f:
+        plt = f.readlines()
+    points = []
+    for point in plt[6:]:
+        lat, lon, _, alt, days, date, time = point.split(',')
+        time = time.replace('\n', '')
+        point_datetime = datetime.strptime(f"{date} {time}", '%Y-%m-%d %H:%M:%S')
+        points.append((float(lat), float(lon), float(alt), float(days), point_datetime))
+    return points
+
+def parse_plt_columns(path : Path) -> list[tuple]:
+    """
+    The batched parser, converted back to the same python objects part1 inserts
+    :param path: The path of the .plt file
+    :returns: A list of (lat, lon, altitude, date_days, date_time) tuples
+    """
+    plt = parse_plt(path)
+    return list(zip(plt.lat.tolist(), plt.lon.tolist(), plt.altitude.tolist(), plt.date_days.tolist(), plt.datetimes()))
+
+def bench(name : str, parser, files : list[Path], repeat : int) -> dict:
+    """
+    Times a parser over a set of files
+    :returns: A row for the results table
+    """
+    best = None
+    points = 0
+    for _ in range(repeat):
+        start = time.perf_counter()
+        points = sum(len(parser(file)) for file in files)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return {'parser': name, 'files': len(files), 'points': points, 'seconds': round(best, 4), 'points/s': int(points / best) if best else 0}
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Micro-benchmark of the .plt parsers on real Geolife files')
+    parser.add_argument('-d', '--data', default='dataset/Data', help='Dataset directory to take .plt files from')
+    parser.add_argument('-n', '--files', type=int, default=200, help='Maximum number of files to parse')
+    parser.add_argument('-r', '--repeat', type=int, default=3, help='Number of repetitions (best time is reported)')
+    args = parser.parse_args()
+
+    files = sorted(Path(args.data).glob('*/Trajectory/*.plt'))[:args.files]
+
+    # Both parsers have to produce the same documents
+    for file in files:
+        assert parse_plt_lines(file) == parse_plt_columns(file), f'Parsers disagree on {file}'
+
+    results = [bench('line-by-line', parse_plt_lines, files, args.repeat),
+               bench('columnar', parse_plt_columns, files, args.repeat)]
+    print(tabulate(results, headers='keys'))
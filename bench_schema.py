@@ -0,0 +1,106 @@
+from Schema import TrackPoint, Activity, geo_point
+from bson.objectid import ObjectId
+from bson.raw_bson import RawBSONDocument
+from datetime import datetime, timedelta
+from tabulate import tabulate
+import argparse
+import bson
+import random
+import time
+import tracemalloc
+
+class LegacyTrackPoint(dict):
+    """
+    The original TrackPoint construction (one __setitem__ call per key)
+    """
+    def __init__(self, id, lat, lon, altitude, date_days, date_time, activity, seq) -> None:
+        super().__setitem__('_id', id)
+        super().__setitem__('lat', lat)
+        super().__setitem__('lon', lon)
+        super().__setitem__('altitude', altitude)
+        super().__setitem__('date_days', date_days)
+        super().__setitem__('date_time', date_time)
+        super().__setitem__('activity', activity)
+        super().__setitem__('seq', seq)
+        super().__setitem__('location', geo_point(lat, lon))
+
+def build_legacy(columns : tuple, activity : Activity, raw : bool = False):
+    """
+    The original loop of part1, a new denormalized activity per point
+    """
+    for seq, (id, lat, lon, alt, days, date_time) in enumerate(zip(*columns)):
+        yield LegacyTrackPoint(id, lat, lon, alt, days, date_time, {'_id': activity['_id'], 'user': activity['user']}, seq)
+
+def build_columns(columns : tuple, activity : Activity, raw : bool = False):
+    """
+    The fast path of part1, one shared denormalized activity
+    """
+    return TrackPoint.from_columns(*columns, activity.denorm(), raw)
+
+def make_columns(points : int) -> tuple:
+    """
+    Creates random columns of one activity
+    """
+    rng = random.Random(0)
+    start = datetime(2008, 4, 1)
+    return ([ObjectId() for _ in range(points)],
+            [39.9 + rng.random() / 10 for _ in range(points)],
+            [116.3 + rng.random() / 10 for _ in range(points)],
+            [rng.randint(0, 300) for _ in range(points)],
+            [39539.0 + i / 86400 for i in range(points)],
+            [start + timedelta(seconds=i) for i in range(points)])
+
+def bench(name : str, build, points : int, batch_size : int, raw : bool, repeat : int) -> dict:
+    """
+    Builds the documents of points TrackPoints in batches (like BulkWriter) and measures the time and the memory of a buffered batch.
+    The time is measured twice: building only, and building plus the BSON encoding the bulk insert does (already done for raw documents).
+    :returns: A row for the results table
+    """
+    activity = Activity(ObjectId(), '112', trackpoints=[])
+    columns = make_columns(batch_size)
+
+    best = best_encoded = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(points // batch_size):
+            batch = list(build(columns, activity, raw))
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+
+        start = time.perf_counter()
+        for _ in range(points // batch_size):
+            encoded = [document.raw if isinstance(document, RawBSONDocument) else bson.encode(document) for document in build(columns, activity, raw)]
+        elapsed = time.perf_counter() - start
+        best_encoded = elapsed if best_encoded is None else min(best_encoded, elapsed)
+
+    tracemalloc.start()
+    batch = list(build(columns, activity, raw))
+    batch_bytes, _ = tracemalloc.get_traced_memory()
+    blocks = sum(stat.count for stat in tracemalloc.take_snapshot().statistics('filename'))
+    tracemalloc.stop()
+    del batch
+
+    per_million = 1_000_000 / (points // batch_size * batch_size)
+    return {'builder': name,
+            'seconds/M points': round(best * per_million, 3),
+            'seconds/M points (encoded)': round(best_encoded * per_million, 3),
+            'bytes/point': batch_bytes // batch_size,
+            'blocks/point': round(blocks / batch_size, 2),
+            'batch MB': round(batch_bytes / 2**20, 1)}
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Micro-benchmark of the TrackPoint document construction (time and memory per million points)')
+    parser.add_argument('-n', '--points', type=int, default=1_000_000, help='Number of TrackPoints to build')
+    parser.add_argument('-b', '--batch-size', type=int, default=10000, help='Number of documents buffered per batch')
+    parser.add_argument('-r', '--repeat', type=int, default=3, help='Number of repetitions (best time is reported)')
+    args = parser.parse_args()
+
+    # Both builders have to produce the same documents
+    activity = Activity(ObjectId(), '112', trackpoints=[])
+    columns = make_columns(100)
+    assert list(build_legacy(columns, activity)) == list(build_columns(columns, activity)), 'Builders disagree'
+
+    results = [bench('legacy (per-key __setitem__, denorm per point)', build_legacy, args.points, args.batch_size, False, args.repeat),
+               bench('from_columns (shared denorm)', build_columns, args.points, args.batch_size, False, args.repeat),
+               bench('from_columns (RawBSONDocument)', build_columns, args.points, args.batch_size, True, args.repeat)]
+    print(tabulate(results, headers='keys'))
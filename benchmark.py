@@ -0,0 +1,63 @@
+from generate_dataset import generate
+from pathlib import Path
+from tabulate import tabulate
+import part1
+import part2
+import argparse
+import json
+import os
+import tempfile
+import time
+
+def benchmark_scale(scale : int, users : int, activities : int, points : int, workers : int, queries : list[str]) -> list[dict]:
+    """
+    Generates a dataset at a scale factor, times the part1 ingestion and every part2 question against it
+    :param scale: The scale factor (multiplies the number of users)
+    :param users: The number of users at scale 1
+    :param activities: The number of activities per user
+    :param points: The average number of points per activity
+    :param workers: The number of part1 worker processes
+    :param queries: The names of the part2 questions to time
+    :returns: One result row per phase/question
+    """
+    results = []
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as root:
+        dataset = generate(Path(root), users * scale, activities, points, seed=scale)
+        os.chdir(root) # part1 reads ./dataset
+        try:
+            part1.dropall()
+            start = time.perf_counter()
+            loaded = part1.main(workers=workers)
+            results.append({'scale': scale, **dataset, 'phase': 'ingest', 'seconds': time.perf_counter() - start,
+                            'rows': loaded[2], 'error': None})
+        finally:
+            os.chdir(cwd)
+
+    db = part2.Database(profile='analytics')
+    for name in queries:
+        run = part2.run_query(db, name) # One at a time, so the timings do not affect each other
+        results.append({'scale': scale, **dataset, 'phase': name, 'seconds': run['seconds'], 'rows': run['rows'], 'error': run['error']})
+    return results
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark part1 ingestion and the part2 questions on synthetic data. '
+                                                 'Uses (and drops!) the database in MONGO_NAME, point it at a local mongod.')
+    parser.add_argument('-s', '--scales', type=int, nargs='+', default=[1, 2, 4], help='Scale factors (multiply the number of users)')
+    parser.add_argument('-u', '--users', type=int, default=10, help='Number of users at scale 1')
+    parser.add_argument('-a', '--activities', type=int, default=50, help='Number of activities per user')
+    parser.add_argument('-p', '--points', type=int, default=500, help='Average number of points per activity')
+    parser.add_argument('-w', '--workers', type=int, default=1, help='Number of part1 worker processes')
+    parser.add_argument('-q', '--queries', nargs='+', default=None, help='The part2 questions to time (default: q1-q11)')
+    parser.add_argument('-o', '--output', default='bench_results.json', help='The JSON file the results are written to')
+    args = parser.parse_args()
+
+    queries = args.queries or part2.POINT_QUERIES
+    results = []
+    for scale in args.scales:
+        results.extend(benchmark_scale(scale, args.users, args.activities, args.points, args.workers, queries))
+
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2)
+
+    print(tabulate([{key : row[key] for key in ('scale', 'points', 'phase', 'seconds', 'rows', 'error')} for row in results], headers='keys'))
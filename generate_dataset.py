@@ -0,0 +1,112 @@
+from pathlib import Path
+from datetime import datetime, timedelta
+from typing import Optional
+import argparse
+import random
+
+HEADER = ['Geolife trajectory', 'WGS 84', 'Altitude is in Feet', 'Reserved 3', '0,2,255,My Track,0,0,2,8421376', '0']
+MODES = ('walk', 'bus', 'car', 'taxi', 'bike', 'subway', 'train', 'airplane')
+DAYS_EPOCH = datetime(1899, 12, 30) # The epoch of the date_days field
+CENTER = (39.916, 116.397)          # Forbidden City, so q10 has matches
+WALK_USER = '112'                   # The default user and start of q7 in part2
+WALK_START = datetime(2008, 4, 1)
+
+def write_activity(path : Path, start : datetime, points : int, rng : random.Random) -> datetime:
+    """
+    Writes a single .plt trajectory as a random walk
+    :param path: The path of the .plt file
+    :param start: The time of the first point
+    :param points: The number of points
+    :param rng: The random generator
+    :returns: The time of the last point
+    """
+    lat = CENTER[0] + rng.uniform(-0.05, 0.05)
+    lon = CENTER[1] + rng.uniform(-0.05, 0.05)
+    alt = rng.randint(50, 300)
+    time = start
+    lines = list(HEADER)
+    for i in range(points):
+        if i:
+            lat += rng.gauss(0, 0.0003)
+            lon += rng.gauss(0, 0.0003)
+            alt += rng.randint(-5, 5)
+            time += timedelta(seconds=rng.choice((1, 2, 5, 5, 5, 10)) if rng.random() > 0.001 else 600) # A rare gap makes the activity invalid (q9)
+        altitude = -777 if rng.random() < 0.01 else alt
+        days = (time - DAYS_EPOCH).total_seconds() / 86400
+        lines.append(f'{lat:.6f},{lon:.6f},0,{altitude},{days:.10f},{time:%Y-%m-%d},{time:%H:%M:%S}')
+    with open(path, 'w', newline='\r\n') as f: # Geolife files use CRLF line endings
+        f.write('\n'.join(lines) + '\n')
+    return time
+
+def generate(root : Path,
+             users : int,
+             activities : int,
+             points : int,
+             labeled_fraction : float = 0.4,
+             oversized_fraction : float = 0.02,
+             seed : int = 0,
+             walk_user : Optional[str] = WALK_USER) -> dict:
+    """
+    Generates a Geolife-style dataset (dataset/Data/<user>/Trajectory/*.plt, labels.txt and labeled_ids.txt)
+    :param root: The directory the dataset directory is created in
+    :param users: The number of users
+    :param activities: The number of activities per user
+    :param points: The average number of points per activity
+    :param labeled_fraction: The fraction of users with a labels.txt
+    :param oversized_fraction: The fraction of activities with more than 2500 points (skipped by part1)
+    :param seed: The seed of the random generator
+    :param walk_user: Also generate this user (if it is not among the first users) with only walks, starting at WALK_START,
+                      so q7 has activities to answer at every scale (None = no walk user)
+    :returns: The number of users, activities and points written
+    """
+    rng = random.Random(seed)
+    data = root / 'dataset' / 'Data'
+    labeled_ids = []
+    user_ids = [f'{user:03d}' for user in range(users)]
+    if walk_user is not None and walk_user not in user_ids:
+        user_ids.append(walk_user)
+    totals = {'users': len(user_ids), 'activities': 0, 'points': 0}
+    for user_id in user_ids:
+        walker = user_id == walk_user
+        trajectory_dir = data / user_id / 'Trajectory'
+        trajectory_dir.mkdir(parents=True, exist_ok=True)
+        labeled = rng.random() < labeled_fraction or walker
+        labels = ['Start Time\tEnd Time\tTransportation Mode']
+
+        if walker:
+            time = WALK_START + timedelta(hours=rng.randint(6, 12))
+        else:
+            time = datetime(2007, 4, 1) + timedelta(days=rng.randint(0, 900), hours=rng.randint(6, 12))
+        for _ in range(activities):
+            count = rng.randint(2501, 3000) if rng.random() < oversized_fraction else max(2, min(2500, int(rng.gauss(points, points / 3))))
+            start = time
+            end = write_activity(trajectory_dir / f'{start:%Y%m%d%H%M%S}.plt', start, count, rng)
+            if walker:
+                labels.append(f'{start:%Y/%m/%d %H:%M:%S}\t{end:%Y/%m/%d %H:%M:%S}\twalk')
+            elif labeled and rng.random() < 0.8:
+                labels.append(f'{start:%Y/%m/%d %H:%M:%S}\t{end:%Y/%m/%d %H:%M:%S}\t{rng.choice(MODES)}')
+            totals['activities'] += 1
+            totals['points'] += count
+            time = end + timedelta(hours=rng.randint(1, 48))
+
+        if labeled:
+            labeled_ids.append(user_id)
+            with open(data / user_id / 'labels.txt', 'w') as f:
+                f.write('\n'.join(labels) + '\n')
+
+    with open(root / 'dataset' / 'labeled_ids.txt', 'w') as f:
+        f.write('\n'.join(labeled_ids) + '\n')
+    return totals
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Generate a synthetic Geolife-style dataset')
+    parser.add_argument('-o', '--output', default='.', help='Directory to create the dataset directory in')
+    parser.add_argument('-u', '--users', type=int, default=20, help='Number of users')
+    parser.add_argument('-a', '--activities', type=int, default=50, help='Number of activities per user')
+    parser.add_argument('-p', '--points', type=int, default=500, help='Average number of points per activity')
+    parser.add_argument('--labeled-fraction', type=float, default=0.4, help='Fraction of users with labels')
+    parser.add_argument('--seed', type=int, default=0, help='Seed of the random generator')
+    parser.add_argument('--no-walk-user', action='store_true', help=f'Do not add user {WALK_USER} with only walks (used by q7)')
+    args = parser.parse_args()
+    print(generate(Path(args.output), args.users, args.activities, args.points, args.labeled_fraction, seed=args.seed,
+                   walk_user=None if args.no_walk_user else WALK_USER))
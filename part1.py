@@ -1,111 +1,401 @@
-from Database import Database
-from Schema import User, Activity, TrackPoint
+from Database import Database, BULK_WRITE_CONCERN
+from Schema import User, Activity, TrackPoint, TrackPointBucket, ManifestEntry
+from PltParser import parse_plt, scan_plt, PltInfo, MAX_POINTS
+from Labels import LabelIndex
+from Profiling import Profiler
+import Kernels
 from pathlib import Path
 import os
-from datetime import datetime
+from datetime import timedelta
+from typing import Optional
 import logging
 from bson.objectid import ObjectId
+from pymongo.write_concern import WriteConcern
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from contextlib import contextmanager, nullcontext
+from tabulate import tabulate
+import argparse
+import hashlib
+import time
 
+BULK_IN_FLIGHT = 4 # Batches in flight per user load in bulk-load mode
 FORMAT = '%(asctime)s : %(levelname)s : %(message)s'
 logging.basicConfig(filename='part1.log', filemode='w', level=logging.INFO, format=FORMAT)
 
-def main() -> None:
+def load_labeled_ids() -> list[str]:
     """
-    Main script for inserting all the data into the database
+    Reads the IDs of the users that have labeled activities
+    :returns: A list of labeled user IDs
     """
-    LABELED_IDS = []
+    labeled_ids = []
     with open(Path('.') / 'dataset' / 'labeled_ids.txt', 'r') as f:
         lines = f.readlines()
         for line in lines:
-            LABELED_IDS.append(line.replace('\n', ''))
+            labeled_ids.append(line.replace('\n', ''))
+    return labeled_ids
+
+def load_user(db : Database,
+              user_dir : Path,
+              labeled : bool,
+              label_tolerance : Optional[timedelta] = None,
+              batch_size : int = 10000,
+              batch_bytes : Optional[int] = None,
+              write_concern : Optional[WriteConcern] = None,
+              layout : str = 'point',
+              bucket_size : int = 500,
+              raw_bson : bool = False,
+              trackpoint_ids : bool = False,
+              in_flight : int = 1,
+              scan : Optional[dict[str, PltInfo]] = None,
+              profiler : Optional[Profiler] = None) -> tuple[int, int, int]:
+    """
+    Parses the new or changed trajectories of a single user and inserts/updates the User, its Activities and TrackPoints.
+    Files that are unchanged since the last load (according to the manifest) are skipped.
+    :param db: The database to insert into
+    :param user_dir: The directory of the user (dataset/Data/<user>)
+    :param labeled: Whether the user has a labels.txt file
+    :param label_tolerance: Also match labels that overlap an activity within this tolerance (None = exact start/end matches only)
+    :param batch_size: The number of TrackPoints per bulk insert
+    :param batch_bytes: Also flush the TrackPoints when a batch reaches this many BSON bytes (None = no limit)
+    :param write_concern: The write concern of the TrackPoint inserts (None = default)
+    :param layout: 'point' stores one TrackPoint document per point, 'bucket' stores TrackPointBuckets of up to bucket_size points
+    :param bucket_size: The maximum number of points per TrackPointBucket
+    :param raw_bson: Encode the TrackPoints to BSON while parsing (RawBSONDocument) instead of buffering dicts
+    :param trackpoint_ids: Also embed the TrackPoint IDs in the Activity (off by default, the points are addressed by (activity._id, seq))
+    :param in_flight: The number of TrackPoint batches that are written at the same time
+    :param scan: The pre-scan of the user's files keyed by path (files missing from it are scanned on the fly)
+    :param profiler: Time the stages of the load (hash, parse, datetimes, summaries, documents, flush, activities) with this profiler
+    :returns: The number of users, activities and trackpoints inserted
+    """
+    timed = profiler.stage if profiler else nullcontext
+    user = user_dir.name
+    user_obj = User(user, labeled, activities=[])
+    trajectory_dir = user_dir / 'Trajectory'
+    if not trajectory_dir.is_dir(): # Users without trajectories are never inserted
+        return 0, 0, 0
+
+    labels = LabelIndex.from_file(user_dir / 'labels.txt') if labeled else None # Read the labels once per user
+    manifest = db.get_manifest(user)                                            # Files that have been loaded before
+    first_load = not manifest                                                   # The User may not exist yet
+
+    activities = []
+    loaded_files = []
+    unchanged = 0
+    removed = 0
+    recorded = 0 # New manifest entries of files without an Activity (oversized or empty)
+    points = 0
+    collection = 'TrackPointBucket' if layout == 'bucket' else 'TrackPoint'
+    track_points = db.bulk_writer(collection, batch_size, batch_bytes, write_concern, in_flight) # TrackPoints are streamed to the database in bounded batches
+    for file in sorted(os.listdir(trajectory_dir)):
+        if file[-3:] != 'plt':
+            continue
+
+        filename = file.split('.')[0]
+        path = trajectory_dir / file
+        stat = path.stat()
+        entry = manifest.pop(path.as_posix(), None)
+        current = is_current(entry, layout)
+        if is_unchanged(entry, stat, layout):
+            unchanged += 1 # Unchanged since the last load
+            continue
+
+        with timed('hash'):
+            info = scan.get(path.as_posix()) if scan else None
+            info = info or scan_plt(path, MAX_POINTS)
+            oversized = info.points > MAX_POINTS
+            sha1 = None if oversized else file_hash(path) # Oversized files are never read in full
+        if current and not oversized and entry['sha1'] == sha1:
+            entry['size'], entry['mtime'] = stat.st_size, stat.st_mtime_ns # Touched but not modified
+            db.upsert_manifest(entry)
+            unchanged += 1
+            continue
+
+        if entry and entry['activity'] is not None: # The file changed, its last load crashed or the layout changed: replace the stale Activity
+            removed += 1
+            if not db.remove_activity(entry['activity'], user):
+                logging.critical(f'Failed to remove the stale Activity of {path}, the file is reloaded by the next run')
+                continue # The manifest entry still references the stale Activity
+
+        entry = ManifestEntry(path.as_posix(), user, stat.st_size, stat.st_mtime_ns, sha1, layout)
+        if oversized: # Only insert activites with fewer than 2501 points, known from the pre-scan without parsing
+            logging.debug(f'Skipped activity: {filename}! TOO BIG! (size>{MAX_POINTS})')
+            entry['status'] = 'done'
+            db.upsert_manifest(entry)
+            recorded += 1
+            continue
+
+        with timed('parse'):
+            plt = parse_plt(path)                                                             # Columnar view of the whole file
+        if len(plt) == 0:
+            logging.debug(f'Skipped activity: {filename}! EMPTY!')
+            entry['status'] = 'done'
+            db.upsert_manifest(entry)
+            recorded += 1
+            continue
+
+        activity = Activity(ObjectId(), user, trackpoints=[])                                 # Create the Activity document
+        entry['activity'] = activity['_id']
+        db.upsert_manifest(entry)                                                             # Recorded as pending before any TrackPoint is written
+        loaded_files.append(entry['_id'])
+
+        with timed('datetimes'):
+            point_datetimes = plt.datetimes()
+        start_datetime = point_datetimes[0]                                                   # Start datetime
+        end_datetime = point_datetimes[-1]                                                    # End datetime
+
+        transportation = labels.lookup(start_datetime, end_datetime, label_tolerance) if labels else None # Transportation mode
+
+        # Update the Activity document
+        activity['transportation_mode'] = transportation
+        activity['start_date_time'] = start_datetime
+        activity['end_date_time'] = end_datetime
+        with timed('summaries'):
+            activity['point_count'] = len(plt)                                                # Summaries used by part2 instead of the raw TrackPoints
+            activity['distance'] = Kernels.path_length(plt.lat, plt.lon)
+            activity['altitude_gain'] = Kernels.altitude_gain(plt.altitude)
+            activity['max_gap'] = Kernels.max_gap(plt.date_time)
+            activity['bbox'] = Kernels.bounding_box(plt.lat, plt.lon)
+
+        points += len(plt)
+        denorm = activity.denorm() # Shared by all TrackPoints (or TrackPointBuckets) of the activity
+        with timed('documents'): # Building the documents, including the writes of the batches that fill up
+            if layout == 'bucket':
+                lats, lons, alts, days = plt.lat.tolist(), plt.lon.tolist(), plt.altitude.tolist(), plt.date_days.tolist()
+                for seq, i in enumerate(range(0, len(plt), bucket_size)):
+                    bucket = TrackPointBucket(id=ObjectId(),
+                                              activity=denorm,
+                                              seq=seq,
+                                              lat=lats[i:i + bucket_size],
+                                              lon=lons[i:i + bucket_size],
+                                              altitude=alts[i:i + bucket_size],
+                                              date_days=days[i:i + bucket_size],
+                                              date_time=point_datetimes[i:i + bucket_size]) # Create TrackPointBucket document
+                    activity['trackpoints'].append(bucket['_id'])   # The Activity references its buckets instead of its points
+                    track_points.add(bucket)
+            else:
+                ids = [ObjectId() for _ in range(len(plt))]
+                if trackpoint_ids:
+                    activity['trackpoints'].extend(ids) # Update the Activity document with trackpoints
+                track_points.extend(TrackPoint.from_columns(ids, plt.lat.tolist(), plt.lon.tolist(), plt.altitude.tolist(), plt.date_days.tolist(), point_datetimes,
+                                                            denorm, raw_bson)) # Create the TrackPoint documents, flushing the batch whenever it is full
+
+        activities.append(activity)                             # Insert activity into list of activites for insertion later
+        user_obj['activities'].append(activity['_id'])
+        logging.debug(f"Created Activity: {activity}")
+
+    # Files that were removed from the dataset since the last load
+    deleted = []
+    for entry in manifest.values():
+        if entry['activity'] is not None:
+            removed += 1
+            if not db.remove_activity(entry['activity'], user):
+                continue # Removed again by the next run
+        deleted.append(entry['_id'])
+    if deleted:
+        db.delete_manifest(deleted)
+
+    # Insert the remaining data associated with the current user into the database
+    with timed('flush'):
+        track_points.close()
+    with timed('activities'):
+        inserted = not activities or db.insert_activities(activities)
+        rolled = not activities or (inserted and db.rollup_activities(activities))
+    upserted = db.upsert_user(user_obj)
+    if track_points.result.ok and inserted and rolled and upserted:
+        db.complete_manifest(loaded_files) # Only now are the Activities complete, a crash or failure before this reloads them
+    elif loaded_files:
+        logging.critical(f'Failed to load user {user}, {len(loaded_files)} files stay pending and are reloaded by the next run')
+    if first_load or activities or removed or recorded or deleted:
+        db.bump_generation() # Invalidates the cached part2 results (a new User without activities also changes q1-q3)
+    logging.info(f"Created User: {user_obj} (unchanged files: {unchanged})")
+    return 1, len(activities), track_points.result.inserted if layout == 'point' else points
+
+def file_hash(path : Path) -> str:
+    """
+    Hashes the contents of a file
+    :param path: The path of the file
+    :returns: The SHA-1 hex digest of the file
+    """
+    with open(path, 'rb') as f:
+        return hashlib.sha1(f.read()).hexdigest()
+
+def is_current(entry : Optional[ManifestEntry], layout : str) -> bool:
+    """
+    Checks whether a manifest entry was loaded completely, in the same layout
+    """
+    return entry is not None and entry['status'] == 'done' and entry.get('layout', 'point') == layout
+
+def is_unchanged(entry : Optional[ManifestEntry], stat : os.stat_result, layout : str) -> bool:
+    """
+    Checks whether a file is unchanged since its last complete load (same size and mtime), so it is skipped without being read
+    """
+    return is_current(entry, layout) and entry['size'] == stat.st_size and entry['mtime'] == stat.st_mtime_ns
+
+def prescan(user_dirs : list[Path],
+            manifests : dict[str, dict[str, ManifestEntry]],
+            layout : str = 'point',
+            limit : int = MAX_POINTS) -> dict[str, dict[str, PltInfo]]:
+    """
+    Pre-scans the new and changed trajectory files of every user (point count, size, first and last time) without parsing them.
+    Files that are unchanged according to the manifest are only stat'ed, so a re-run costs time proportional to the changes.
+    :param user_dirs: The user directories (dataset/Data/<user>)
+    :param manifests: The manifest entries of every user keyed by path (Database.get_manifest())
+    :param layout: The TrackPoint layout of the load (files loaded in another layout are reloaded)
+    :param limit: Stop counting the points of a file above this limit
+    :returns: The pre-scans keyed by user and path (unchanged files are left out)
+    """
+    scans = {}
+    skipped = 0
+    for user_dir in user_dirs:
+        trajectory_dir = user_dir / 'Trajectory'
+        files = sorted(trajectory_dir.glob('*.plt')) if trajectory_dir.is_dir() else []
+        manifest = manifests.get(user_dir.name, {})
+        scans[user_dir.name] = {}
+        for file in files:
+            if is_unchanged(manifest.get(file.as_posix()), file.stat(), layout):
+                skipped += 1
+                continue
+            scans[user_dir.name][file.as_posix()] = scan_plt(file, limit)
+    infos = [info for user in scans.values() for info in user.values()]
+    oversized = sum(info.points > limit for info in infos)
+    logging.info(f'Pre-scanned {len(infos)} files ({skipped} unchanged): {oversized} oversized, {sum(info.points for info in infos if info.points <= limit)} points to load')
+    return scans
+
+_worker_db = None # The database of a worker process, shared by all users it loads
+
+def _load_user_worker(user_dir : Path, labeled : bool, **options) -> tuple[tuple[int, int, int], float]:
+    """
+    Process pool entry point. Every worker process inserts over its own pooled client, created for its first user
+    and kept until the process exits.
+    :returns: The counts of load_user() and the seconds the load took
+    """
+    global _worker_db
+    if _worker_db is None:
+        _worker_db = Database(profile='ingest')
+    start = time.perf_counter()
+    return load_user(_worker_db, user_dir, labeled, **options), time.perf_counter() - start
+
+@contextmanager
+def stage(db : Database, timings : dict[str, float], name : str, profiler : Optional[Profiler] = None):
+    """
+    Times a stage of the load (and attributes its database commands to it)
+    :param db: The database
+    :param timings: The seconds per stage, updated when the stage ends
+    :param name: The name of the stage
+    :param profiler: Also record the stage in this profiler
+    """
+    start = time.perf_counter()
+    try:
+        with db.phase(name), (profiler.stage(name) if profiler else nullcontext()):
+            yield
+    finally:
+        timings[name] = timings.get(name, 0) + time.perf_counter() - start
+
+def main(workers : int = 1,
+         defer_indexes : bool = False,
+         bulk_load : bool = False,
+         instrument : bool = False,
+         instrument_json : Optional[str] = None,
+         profiler : Optional[Profiler] = None,
+         **options) -> tuple[int, int, int]:
+    """
+    Main script for inserting all the data into the database
+    :param workers: The number of processes that parse and insert users in parallel (1 = serial)
+    :param defer_indexes: Build the secondary indexes after the load instead of before it
+    :param bulk_load: Bulk-load mode for first-time loads: drop the secondary indexes and rebuild them afterwards, insert with
+                      BULK_WRITE_CONCERN and BULK_IN_FLIGHT batches in flight (unless given in options), then verify the counts
+    :param instrument: Record the database commands of every phase and log a report (the commands of worker processes are not recorded)
+    :param instrument_json: Also write the report to this JSON file
+    :param profiler: Profile the stages of the load, the stages of every user (serial loads only) and the throughput per user.
+                     It is started and stopped by main() and its report is logged.
+    :param options: Keyword arguments passed on to load_user() (label_tolerance, batch_size, batch_bytes, write_concern, layout, bucket_size, raw_bson, trackpoint_ids, in_flight)
+    :returns: The number of users, activities and trackpoints loaded
+    """
+    LABELED_IDS = load_labeled_ids()
     logging.debug(f"Labeled IDs: {LABELED_IDS}")
 
-    # Create the collections
-    db = Database()
-    if not db.create_collection('User'):
-        quit()
-    if not db.create_collection("Activity"):
-        quit()
-    if not db.create_collection("TrackPoint"):
-        quit()
-
-    user_obj = None
-    for root, dirs, files in os.walk("dataset/Data", topdown=True):
-        match len(Path(root).parts): # Dataset depth
-            case 3: # User 
-                user = Path(root).parts[2]
-                user_obj = User(user, user in LABELED_IDS, activities=[])
-            case 4: # Activities
-                activities = []
-                track_points = []
-                for file in files:
-                    if file[-3:] != 'plt':
-                        continue
-
-                    filename = file.split('.')[0]
-                    plt = []
-
-                    with open(Path(root) / file, 'r') as f:
-                        plt = f.readlines()
-
-                    if len(plt[6:]) > 2500: # Only insert activites with fewer than 2501 points
-                        logging.debug(f'Skipped activity: {filename}! TOO BIG! (size={len(plt[6:])})')
-                        continue
-
-                    activity = Activity(ObjectId(), user, trackpoints=[])                                 # Create the Activity document
-
-                    first_line = plt[6].split(',')
-                    start_date = first_line[-2]
-                    start_time = first_line[-1].replace('\n', '')
-                    start_datetime = datetime.strptime(f'{start_date} {start_time}', '%Y-%m-%d %H:%M:%S', )     # Start datetime
-
-                    last_line = plt[-1].split(',')
-                    end_date = last_line[-2]
-                    end_time = last_line[-1].replace('\n', '')
-                    end_datetime = datetime.strptime(f'{end_date} {end_time}', '%Y-%m-%d %H:%M:%S')             # End datetime
-
-                    transportation = None # Transportation mode
-                    if user in LABELED_IDS:
-                        with open(Path(*Path(root).parts[:3]) / 'labels.txt', 'r') as f:
-                            labels = f.readlines()
-                        for label in labels[1:]:
-                            label = label.split()
-                            label_start = datetime.strptime(f'{label[0]} {label[1]}', '%Y/%m/%d %H:%M:%S')
-                            label_end = datetime.strptime(f'{label[2]} {label[3]}', '%Y/%m/%d %H:%M:%S', )
-                            if label_start == start_datetime and label_end == end_datetime:
-                                transportation = label[4]
-                                break
-                    
-                    # Update the Activity document
-                    activity['transportation_mode'] = transportation
-                    activity['start_date_time'] = start_datetime
-                    activity['end_date_time'] = end_datetime
-
-                    for point in plt[6:]:
-                        lat, lon, _, alt, days, date, time = point.split(',')
-                        time = time.replace('\n', '')
-                        point_datetime = datetime.strptime(f"{date} {time}", '%Y-%m-%d %H:%M:%S')
-                        trackpoint = TrackPoint(id=ObjectId(),
-                                                lat=float(lat),
-                                                lon=float(lon),
-                                                altitude=float(alt),
-                                                date_days=float(days),
-                                                date_time=point_datetime,
-                                                activity=activity.denorm()) # Create TrackPoint document
-                        activity['trackpoints'].append(trackpoint['_id'])   # Update the Activity document with trackpoints
-                        track_points.append(trackpoint)                     # Insert trackpoint into list of trackpoints for insertion later
-                        logging.debug(f"Created TrackPoint: {trackpoint}")
-
-                    activities.append(activity)                             # Insert activity into list of activites for insertion later
-                    user_obj['activities'].append(activity['_id'])
-                    logging.debug(f"Created Activity: {activity}")
-
-                # Insert all data associated with the current user into the database
-                db.insert_trackpoints(track_points)
-                db.insert_activities(activities)
-                db.insert_user(user_obj)
-                logging.info(f"Created User: {user_obj}")
-                    
+    if bulk_load:
+        defer_indexes = True
+        options['write_concern'] = options.get('write_concern') or BULK_WRITE_CONCERN
+        options.setdefault('in_flight', BULK_IN_FLIGHT)
+
+    # Create the collections (a previous, possibly incomplete, load is resumed)
+    db = Database(profile='ingest', instrument=instrument or instrument_json is not None)
+    timings = {}
+    if profiler:
+        profiler.start()
+    with stage(db, timings, 'collections', profiler):
+        trackpoint_collection = 'TrackPointBucket' if options.get('layout') == 'bucket' else 'TrackPoint'
+        missing_rollup = not db.has_collection('Rollup')
+        for collection in ('User', 'Activity', trackpoint_collection, 'Manifest', 'Rollup'):
+            if not db.has_collection(collection) and not db.create_collection(collection):
+                quit()
+        # Activities loaded before the rollups existed, or an incremental update failed in a previous run
+        if (missing_rollup and db.db.Activity.estimated_document_count()) or db.rollup_stale():
+            db.rebuild_rollup()
+    if bulk_load:
+        with stage(db, timings, 'drop_indexes', profiler): # Every insert would also have to update them
+            db.drop_indexes()
+    if not defer_indexes:
+        with stage(db, timings, 'indexes', profiler):
+            db.ensure_indexes()
+
+    user_dirs = sorted(path for path in (Path('dataset') / 'Data').iterdir() if path.is_dir())
+    with stage(db, timings, 'prescan', profiler):
+        manifests = {user_dir.name : db.get_manifest(user_dir.name) for user_dir in user_dirs}
+        scans = prescan(user_dirs, manifests, options.get('layout', 'point'))
+
+    totals = [0, 0, 0]
+    if workers <= 1:
+        with stage(db, timings, 'load', profiler):
+            for user_dir in user_dirs:
+                start = time.perf_counter()
+                counts = load_user(db, user_dir, user_dir.name in LABELED_IDS, scan=scans[user_dir.name], profiler=profiler, **options)
+                if profiler and counts[0]:
+                    profiler.add_user(user_dir.name, counts[2], time.perf_counter() - start)
+                totals = [total + count for total, count in zip(totals, counts)]
+    else:
+        # The users with the most points to load are submitted first, so the workers finish at about the same time.
+        # Unchanged files are only stat'ed by load_user(), so they carry no weight.
+        weights = {user : sum(info.points for info in scan.values() if info.points <= MAX_POINTS) for user, scan in scans.items()}
+        user_dirs = sorted(user_dirs, key=lambda user_dir: weights[user_dir.name], reverse=True)
+        with stage(db, timings, 'load', profiler), ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = {executor.submit(_load_user_worker, user_dir, user_dir.name in LABELED_IDS, scan=scans[user_dir.name], **options) : user_dir for user_dir in user_dirs}
+            for future in as_completed(futures):
+                try:
+                    counts, seconds = future.result()
+                except Exception as e:
+                    logging.critical(f'Failed to load user {futures[future].name} -> \n{e}')
+                    continue
+                if profiler and counts[0]:
+                    profiler.add_user(futures[future].name, counts[2], seconds)
+                totals = [total + count for total, count in zip(totals, counts)]
+
+    if db.rollup_stale(): # An update failed during this load (also in a worker process)
+        with stage(db, timings, 'rollup', profiler):
+            db.rebuild_rollup()
+    if defer_indexes:
+        with stage(db, timings, 'indexes', profiler):
+            db.ensure_indexes()
+    if bulk_load:
+        with stage(db, timings, 'verify', profiler):
+            counts = db.verify_counts(options.get('layout', 'point'))
+        print(f'Verified counts: {counts}')
+
+    logging.info(f'Loaded {totals[0]} users, {totals[1]} activities and {totals[2]} trackpoints (workers={workers})')
+    print(f'Loaded {totals[0]} users, {totals[1]} activities and {totals[2]} trackpoints')
+    table = tabulate([{'phase': name, 'seconds': round(seconds, 3)} for name, seconds in timings.items()], headers='keys')
+    logging.info(f'Seconds per phase:\n{table}')
+    print(table)
+    if db.recorder:
+        logging.info(f'Database commands per phase:\n{db.recorder.table()}')
+        if instrument_json:
+            db.recorder.dump(instrument_json)
+    if profiler:
+        profiler.stop()
+        logging.info(f'Profile:\n{profiler.table()}')
+    return tuple(totals)
+
 def dropall() -> None:
     """
     Script for resetting the database (Used during development)
@@ -114,7 +404,51 @@ def dropall() -> None:
     db.drop_collection("User")
     db.drop_collection("Activity")
     db.drop_collection("TrackPoint")
+    db.drop_collection("TrackPointBucket")
+    db.drop_collection("Manifest")
+    db.drop_collection("Rollup")
+    db.bump_generation() # Meta is kept, a reset generation would match results cached before the drop
 
 if __name__ == '__main__':
-    main()
+    parser = argparse.ArgumentParser(description='Insert the Geolife dataset into the database')
+    parser.add_argument('-w', '--workers', type=int, default=1, help='Number of processes used for parsing and inserting users')
+    parser.add_argument('--label-tolerance', type=float, default=None, help='Match labels that overlap an activity within this many seconds (default: exact matches only)')
+    parser.add_argument('--batch-size', type=int, default=10000, help='Number of TrackPoints per bulk insert')
+    parser.add_argument('--batch-bytes', type=int, default=None, help='Also flush TrackPoint batches after this many BSON bytes')
+    parser.add_argument('--unjournaled', action='store_true', help='Insert TrackPoints with the bulk-load write concern (w=1, j=False)')
+    parser.add_argument('--layout', choices=('point', 'bucket'), default='point', help='Store one document per TrackPoint or one per bucket of points')
+    parser.add_argument('--bucket-size', type=int, default=500, help='Maximum number of points per TrackPointBucket')
+    parser.add_argument('--raw-bson', action='store_true', help='Encode TrackPoints to BSON while parsing, the buffered batches use less memory')
+    parser.add_argument('--trackpoint-ids', action='store_true', help='Also embed the TrackPoint IDs in the Activities (by default they are addressed by activity and seq)')
+    parser.add_argument('--bulk-load', action='store_true', help='First-time load: drop the secondary indexes, insert unjournaled with several batches in flight, rebuild the indexes and verify the counts')
+    parser.add_argument('--in-flight', type=int, default=None, help=f'Number of TrackPoint batches written at the same time (default: 1, {BULK_IN_FLIGHT} with --bulk-load)')
+    parser.add_argument('--defer-indexes', action='store_true', help='Build the secondary indexes after loading instead of before')
+    parser.add_argument('--instrument', action='store_true', help='Log the database commands of every phase to part1.log')
+    parser.add_argument('--instrument-json', default=None, help='Also write the database command report to this JSON file')
+    parser.add_argument('--profile', action='store_true', help='Log the time of every stage and the points/s of every user to part1.log')
+    parser.add_argument('--profile-memory', action='store_true', help='Also log the tracemalloc peak of every stage and the top allocation sites (slow)')
+    parser.add_argument('--cprofile', default=None, help='Also write cProfile statistics of the main process to this file')
+    parser.add_argument('--profile-json', default=None, help='Also write the profile report to this JSON file')
+    args = parser.parse_args()
+
+    profiler = None
+    if args.profile or args.profile_memory or args.cprofile or args.profile_json:
+        profiler = Profiler(cprofile=args.cprofile, memory=args.profile_memory)
+    main(workers=args.workers,
+         defer_indexes=args.defer_indexes,
+         bulk_load=args.bulk_load,
+         instrument=args.instrument,
+         instrument_json=args.instrument_json,
+         profiler=profiler,
+         label_tolerance=timedelta(seconds=args.label_tolerance) if args.label_tolerance is not None else None,
+         batch_size=args.batch_size,
+         batch_bytes=args.batch_bytes,
+         write_concern=BULK_WRITE_CONCERN if args.unjournaled else None,
+         layout=args.layout,
+         bucket_size=args.bucket_size,
+         raw_bson=args.raw_bson,
+         trackpoint_ids=args.trackpoint_ids,
+         in_flight=args.in_flight or (BULK_IN_FLIGHT if args.bulk_load else 1))
+    if args.profile_json:
+        profiler.dump(args.profile_json)
     # dropall()
\ No newline at end of file
@@ -1,18 +1,64 @@
-from Database import Database
+from Database import Database, id_range
+from Cache import QueryCache, MISSING
+from Profiling import Profiler
+from ColumnStore import ColumnStore
 from datetime import datetime, timedelta
 from haversine import haversine, Unit
 from pprint import pprint
 from icecream import ic # For debugging
+from math import cos, radians
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, Executor
+from contextlib import nullcontext
+from tabulate import tabulate
+from typing import Any, Optional
+import time
+import Kernels
+import argparse
+import inspect
+import multiprocessing
+import warnings
+import numpy as np
+import os
 
-def q1(database : Database) -> None:
+# The default parameters of the parameterized questions (q7 and q10)
+WALK_USER = '112'
+WALK_START, WALK_END = datetime(2008, 4, 1), datetime(2009, 1, 1)
+CITY_COORDS = (39.916, 116.397) # The forbidden city
+CITY_RADIUS = 1000              # Meters
+
+STORE_PATH = os.environ.get('TRACKPOINT_STORE', 'trackpoints.store') # The local columnar store of the _store questions (built by ColumnStore.py)
+_stores = {}
+_unchecked = set() # Stores built from .plt files that were warned about
+
+def open_store(path : Optional[str] = None, database : Optional[Database] = None) -> ColumnStore:
+    """
+    Opens a ColumnStore once per process, the questions share its memory maps
+    :param path: The directory of the store (None = STORE_PATH)
+    :param database: Refuse a store exported from this database at an older generation (None = no check)
+    :returns: The store
+    """
+    path = path or STORE_PATH
+    if path not in _stores:
+        _stores[path] = ColumnStore(path)
+    store = _stores[path]
+    if database is not None:
+        if store.source == 'database' and store.generation != database.generation():
+            raise ValueError(f'The store {path} was exported at generation {store.generation}, the database is at {database.generation()}. '
+                               'Rebuild it with python ColumnStore.py database')
+        if store.source != 'database' and path not in _unchecked:
+            _unchecked.add(path)
+            warnings.warn(f'The store {path} was built from .plt files, it cannot be checked against the database')
+    return store
+
+def q1(database : Database) -> dict:
     db = database.db
-    print(f'Question 1\n')
-    print(f'Number of documents in User: {db.User.count_documents({})}')
-    print(f'Number of documents in Activity: {db.Activity.count_documents({})}')
-    print(f'Number of documents in TrackPoint: {db.TrackPoint.count_documents({})}')
-    print()
+    return {
+        'User': db.User.count_documents({}),
+        'Activity': db.Activity.count_documents({}),
+        'TrackPoint': db.TrackPoint.count_documents({})
+    }
 
-def q2(database : Database) -> None:
+def q2(database : Database) -> float:
     db = database.db
     results = db.User.aggregate([
         {
@@ -22,11 +68,9 @@ def q2(database : Database) -> None:
             '$group': {'_id': None, 'avgActivities': {'$avg': '$activities'}}
         }
     ])
-    print('Question 2\n')
-    print(f'Average number of activities per user: {list(results)[0]['avgActivities']}')
-    print()
+    return list(results)[0]['avgActivities']
 
-def q3(database : Database) -> None:
+def q3(database : Database) -> list:
     db = database.db
     results = db.User.aggregate([
         {
@@ -48,12 +92,9 @@ def q3(database : Database) -> None:
             }
         }
     ])
-    print('Question 3\n')
-    print('Top users by number of activities:')
-    pprint(list(results)[0]['topUsers'])
-    print()
+    return list(results)[0]['topUsers']
 
-def q4(database : Database) -> None:
+def q4(database : Database) -> list:
     db = database.db
     results = db.Activity.aggregate([
         {
@@ -63,12 +104,9 @@ def q4(database : Database) -> None:
             '$group': {'_id': None, 'unique_users': {'$addToSet': '$user'}}
         }
     ])
-    print('Question 4\n')
-    print('Users that have used a taxi:')
-    pprint(list(results)[0]['unique_users'])
-    print()
+    return list(results)[0]['unique_users']
 
-def q5(database : Database) -> None:
+def q5(database : Database) -> list:
     db = database.db
     results = db.Activity.aggregate([
         {
@@ -88,12 +126,9 @@ def q5(database : Database) -> None:
             }
         }
     ])
-    print('Question 5\n')
-    print('Transportation modes and number of activities:')
-    pprint(list(results))
-    print()
+    return list(results)
 
-def q6a(database : Database) -> None:
+def q6a(database : Database) -> int:
     db = database.db
     results = db.Activity.aggregate([
         {
@@ -118,12 +153,9 @@ def q6a(database : Database) -> None:
             }
         }
     ])
-    print('Question 6(a):\n')
-    print('Year with the greatest number of activities:')
-    pprint(list(results)[0]['topYear'])
-    print()
+    return list(results)[0]['topYear']
 
-def q6b(database : Database) -> None:
+def q6b(database : Database) -> int:
     db = database.db
     results = db.Activity.aggregate([
         {
@@ -154,24 +186,21 @@ def q6b(database : Database) -> None:
             }
         }
     ])
-    print('Question 6(b):\n')
-    print('Year with the greatest number of hours recorded:')
-    pprint(list(results)[0]['topYear'])
-    print()
+    return list(results)[0]['topYear']
 
-def q7(database : Database) -> None:
+def q7(database : Database, user : str = WALK_USER, start : datetime = WALK_START, end : datetime = WALK_END, activity_range : Optional[tuple] = None) -> float:
     db = database.db
-    activities = db.Activity.find({'user': '112', 'transportation_mode': 'walk'})
+    activities = [activity['_id'] for activity in db.Activity.find({'user': user, 'transportation_mode': 'walk', **id_range('_id', activity_range)}, {'_id': 1})]
     distance_walked = 0
-    for activity in activities:
-        trackpoints = db.TrackPoint.find({'_id': {'$in': activity['trackpoints']},
-                                           'date_time': 
-                                           {
-                                               '$gte': datetime(2008, 4, 1),
-                                                '$lt': datetime(2009, 1, 1)
-                                           }
-                                        })
-
+    for _, trackpoints in database.trackpoints_by_activity(activities,
+                                                          {
+                                                              'date_time':
+                                                              {
+                                                                  '$gte': start,
+                                                                  '$lt': end
+                                                              }
+                                                          },
+                                                          {'lat': 1, 'lon': 1}):
         prev_latlon = None
         for trackpoint in trackpoints:
             lat, lon = float(trackpoint['lat']), float(trackpoint['lon'])
@@ -184,14 +213,11 @@ def q7(database : Database) -> None:
             distance_walked += dist
             prev_latlon = (lat, lon)
     
-    print('Question 7:\n')
-    print('Total distance walked by user 112 (kilometers):')
-    pprint(distance_walked)
-    print()
+    return distance_walked
 
-def q8(database : Database) -> None:
+def q8(database : Database, user_range : Optional[tuple] = None) -> list:
     db = database.db
-    trackpoints = db.TrackPoint.find({'altitude': {'$ne': '-777'}}).sort([('activity.user', 1), ('activity._id', 1), ('_id', 1)])
+    trackpoints = db.TrackPoint.find({'altitude': {'$ne': '-777'}, **id_range('activity.user', user_range)}).sort([('activity.user', 1), ('activity._id', 1), ('seq', 1)])
 
     users = {}
     prev_alt = None
@@ -227,20 +253,15 @@ def q8(database : Database) -> None:
 
     results = sorted(results, key=lambda item: item['gained'], reverse=True)
 
-    print('Question 8:\n')
-    print('Top 20 users who have gained the most altitude in meters (gross):')
-    pprint(results[:20])
-    print()
+    return results[:20]
 
-def q9(database : Database) -> None:
+def q9(database : Database, user_range : Optional[tuple] = None) -> dict:
     db = database.db
-    activities = db.Activity.find({})
+    activities = [activity['_id'] for activity in db.Activity.find(id_range('user', user_range), {'_id': 1})]
 
     results = {}
 
-    for activity in activities:
-        trackpoints = db.TrackPoint.find({'_id': {'$in': activity['trackpoints']}}).sort('_id', 1)
-
+    for _, trackpoints in database.trackpoints_by_activity(activities, projection={'date_time': 1, 'activity.user': 1}, chunk_size=1000):
         prev_datetime = None
         for trackpoint in trackpoints:
             cur_datetime = trackpoint['date_time']
@@ -255,50 +276,357 @@ def q9(database : Database) -> None:
                     results[trackpoint['activity']['user']] += 1
                 break
             prev_datetime = cur_datetime
-    print('Question 9:\n')
-    print('Users that have invalid activities and the number of invalid activities per user:')
-    pprint(results)
-    print()
+    return results
+
+def q10(database : Database, coords : tuple[float, float] = CITY_COORDS, radius : float = CITY_RADIUS, user_range : Optional[tuple] = None) -> list:
+    users = database.users_within(*coords, radius, id_range('activity.user', user_range))
+    return users
 
-def q10(database : Database) -> None:
+def q11(database : Database) -> list:
     db = database.db
-    trackpoints = db.TrackPoint.find({})
+    results = db.Activity.aggregate([
+        {
+            '$match': {'transportation_mode': {'$ne': None}}
+        },
+        {
+            '$group': 
+            {
+                '_id': {'user': '$user', 'transportation_mode': '$transportation_mode'},
+                'count': {'$sum': 1}
+            }
+        },
+        {
+            '$sort': 
+            {
+                '_id.user': 1,
+                'count': -1
+            }
+        },
+        {
+            '$group':
+            {
+                '_id': {'user': '$_id.user'},
+                'transportation_mode': {'$first': '$_id.transportation_mode'},
+            }
+        },
+        {
+            '$sort': {'_id.user': 1}
+        }
+    ])
 
-    CITY_COORDS = (39.916, 116.397)
+    results = [(i['_id']['user'], i['transportation_mode']) for i in results]
+    return list(results)
 
+def q7_summary(database : Database, user : str = WALK_USER, start : datetime = WALK_START, end : datetime = WALK_END) -> float:
+    db = database.db
+    # Only whole activities inside the date range are counted, the summaries cannot be split at the range boundaries
+    results = list(db.Activity.aggregate([
+        {
+            '$match':
+            {
+                'user': user,
+                'transportation_mode': 'walk',
+                'start_date_time': {'$gte': start},
+                'end_date_time': {'$lt': end}
+            }
+        },
+        {
+            '$group': {'_id': None, 'distance': {'$sum': '$distance'}}
+        }
+    ]))
+    return results[0]['distance'] if results else 0
+
+def q8_summary(database : Database) -> list:
+    db = database.db
+    results = db.Activity.aggregate([
+        {
+            '$group': {'_id': '$user', 'gained': {'$sum': '$altitude_gain'}}
+        },
+        {
+            '$sort': {'gained': -1}
+        },
+        {
+            '$limit': 20
+        }
+    ])
+
+    results = [{'user': result['_id'], 'gained': int(result['gained']*0.3048)} for result in results]
+    return results
+
+def q9_summary(database : Database) -> dict:
+    db = database.db
+    results = db.Activity.aggregate([
+        {
+            '$match': {'max_gap': {'$gt': timedelta(minutes=5).total_seconds()}}
+        },
+        {
+            '$group': {'_id': '$user', 'count': {'$sum': 1}}
+        },
+        {
+            '$sort': {'_id': 1}
+        }
+    ])
+
+    results = {result['_id']: result['count'] for result in results}
+    return results
+
+def q8_pipeline(database : Database, n : int = 20) -> list:
+    db = database.db
+    # Window functions compute the delta to the previous point of the same activity on the server, only the top n users are returned
+    results = db.TrackPoint.aggregate([
+        {
+            '$match': {'altitude': {'$ne': Kernels.INVALID_ALTITUDE}}
+        },
+        {
+            '$setWindowFields':
+            {
+                'partitionBy': '$activity._id',
+                'sortBy': {'seq': 1},
+                'output': {'prev_altitude': {'$shift': {'output': '$altitude', 'by': -1}}}
+            }
+        },
+        {
+            '$project':
+            {
+                'user': '$activity.user',
+                'gain': {'$max': [0, {'$subtract': ['$altitude', '$prev_altitude']}]} # The first point of an activity has no previous altitude (null)
+            }
+        },
+        {
+            '$group': {'_id': '$user', 'gained': {'$sum': '$gain'}}
+        },
+        {
+            '$sort': {'gained': -1}
+        },
+        {
+            '$limit': n
+        }
+    ], allowDiskUse=True)
+
+    results = [{'user': result['_id'], 'gained': int(result['gained']*0.3048)} for result in results]
+    return results
+
+def q8_columnar(database : Database) -> list:
+    users = {}
+    for columns in database.trackpoint_columns(('altitude',)):
+        valid = columns['altitude'] != Kernels.INVALID_ALTITUDE
+        gains = Kernels.segment_positive_deltas(columns['altitude'][valid], columns['activity'][valid])
+        for user, gained in Kernels.group_sum(columns['user'][valid], gains).items():
+            users[user] = users.get(user, 0) + gained
+
+    results = [{'user': key, 'gained': int(value*0.3048)} for key, value in users.items()]
+    results = sorted(results, key=lambda item: item['gained'], reverse=True)
+
+    return results[:20]
+
+def q10_columnar(database : Database, coords : tuple[float, float] = CITY_COORDS, radius : float = CITY_RADIUS) -> list:
+    db = database.db
+    user_count = db.User.count_documents({})
     results = {}
+    for columns in database.trackpoint_columns(('lat', 'lon'), ordered=False):
+        near = Kernels.haversine_to(columns['lat'], columns['lon'], coords) <= radius / 1000
+        for user in columns['user'][near].tolist():
+            results.setdefault(user, True)
+        if len(results) == user_count: # Every user has been found
+            break
 
-    for trackpoint in trackpoints:
-        user = trackpoint['activity']['user']
+    users = [key for key in results]
+    return users
+
+def q1_bucket(database : Database) -> dict:
+    db = database.db
+    results = list(db.TrackPointBucket.aggregate([
+        {
+            '$group': {'_id': None, 'points': {'$sum': '$count'}}
+        }
+    ]))
+    return {
+        'User': db.User.count_documents({}),
+        'Activity': db.Activity.count_documents({}),
+        'TrackPoint': results[0]['points'] if results else 0
+    }
+
+def q7_bucket(database : Database, user : str = WALK_USER, start : datetime = WALK_START, end : datetime = WALK_END) -> float:
+    db = database.db
+    activities = [activity['_id'] for activity in db.Activity.find({'user': user, 'transportation_mode': 'walk'}, {'_id': 1})]
+    buckets = db.TrackPointBucket.find({'activity._id': {'$in': activities},
+                                        'start_date_time': {'$lt': end},
+                                        'end_date_time': {'$gte': start}
+                                        },
+                                       {'activity': 1, 'lat': 1, 'lon': 1, 'date_time': 1}).sort([('activity._id', 1), ('seq', 1)])
+    distance_walked = 0
+    prev_act = None
+    prev_latlon = None
+    for bucket in buckets:
+        if bucket['activity']['_id'] != prev_act:
+            prev_act = bucket['activity']['_id']
+            prev_latlon = None
+        for lat, lon, date_time in zip(bucket['lat'], bucket['lon'], bucket['date_time']):
+            if not start <= date_time < end:
+                continue
+            if prev_latlon:
+                distance_walked += haversine(prev_latlon, (lat, lon), unit=Unit.KILOMETERS)
+            prev_latlon = (lat, lon)
+
+    return distance_walked
+
+def q8_bucket(database : Database) -> list:
+    db = database.db
+    buckets = db.TrackPointBucket.find({}, {'activity': 1, 'altitude': 1}).sort([('activity._id', 1), ('seq', 1)])
+
+    users = {}
+    prev_act = None
+    prev_alt = None
+    for bucket in buckets:
+        user = bucket['activity']['user']
+        if bucket['activity']['_id'] != prev_act:
+            prev_act = bucket['activity']['_id']
+            prev_alt = None
+        users.setdefault(user, 0)
+        for alt in bucket['altitude']:
+            if alt == -777: # Invalid altitude
+                continue
+            if prev_alt is not None and alt > prev_alt:
+                users[user] += alt - prev_alt
+            prev_alt = alt
+
+    results = [{'user': key, 'gained': int(value*0.3048)} for key, value in users.items()]
+    results = sorted(results, key=lambda item: item['gained'], reverse=True)
+
+    return results[:20]
+
+def q9_bucket(database : Database) -> dict:
+    db = database.db
+    buckets = db.TrackPointBucket.find({}, {'activity': 1, 'date_time': 1}).sort([('activity._id', 1), ('seq', 1)])
+
+    results = {}
+    prev_act = None
+    prev_datetime = None
+    invalid = False
+    for bucket in buckets:
+        if bucket['activity']['_id'] != prev_act:
+            prev_act = bucket['activity']['_id']
+            prev_datetime = None
+            invalid = False
+        if invalid: # Already counted
+            continue
+        for cur_datetime in bucket['date_time']:
+            if prev_datetime is not None and (cur_datetime - prev_datetime) > timedelta(minutes=5):
+                user = bucket['activity']['user']
+                results[user] = results.get(user, 0) + 1
+                invalid = True
+                break
+            prev_datetime = cur_datetime
+
+    return results
+
+def q10_bucket(database : Database, coords : tuple[float, float] = CITY_COORDS, radius : float = CITY_RADIUS) -> list:
+    db = database.db
+    # Only buckets whose bounding box lies within ~radius meters of the city can contain a matching point
+    lat_margin = radius / 111_000
+    lon_margin = radius / (111_000 * cos(radians(coords[0])))
+    buckets = db.TrackPointBucket.find({'bbox.min_lat': {'$lte': coords[0] + lat_margin},
+                                        'bbox.max_lat': {'$gte': coords[0] - lat_margin},
+                                        'bbox.min_lon': {'$lte': coords[1] + lon_margin},
+                                        'bbox.max_lon': {'$gte': coords[1] - lon_margin}
+                                        },
+                                       {'activity': 1, 'lat': 1, 'lon': 1})
+
+    results = {}
+    for bucket in buckets:
+        user = bucket['activity']['user']
         if user in results:
             continue
+        for latlon in zip(bucket['lat'], bucket['lon']):
+            if haversine(coords, latlon, unit=Unit.METERS) <= radius:
+                results[user] = True
+                break
 
-        latlon = float(trackpoint['lat']), float(trackpoint['lon'])
-        dist = haversine(CITY_COORDS, latlon, unit=Unit.METERS)
-        if dist <= 1000:
-            results[user] = True
-    
     users = [key for key in results]
-    print('Question 10:\n')
-    print('Users that have been to the forbidden city (within 1000 meters of center):')
-    pprint(users)
-    print()
+    return users
 
-def q11(database : Database) -> None:
+def q2_rollup(database : Database) -> float:
     db = database.db
-    results = db.Activity.aggregate([
+    results = list(db.Rollup.aggregate([
         {
-            '$match': {'transportation_mode': {'$ne': None}}
+            '$group': {'_id': None, 'activities': {'$sum': '$count'}}
+        }
+    ]))
+    users = db.User.count_documents({})
+    return results[0]['activities'] / users if results and users else 0
+
+def q3_rollup(database : Database) -> list:
+    db = database.db
+    results = db.Rollup.aggregate([
+        {
+            '$group': {'_id': '$_id.user', 'numActivities': {'$sum': '$count'}}
         },
         {
-            '$group': 
+            '$sort': {'numActivities': -1, '_id': 1}
+        },
+        {
+            '$limit': 20
+        }
+    ])
+    return [result['_id'] for result in results]
+
+def q5_rollup(database : Database) -> list:
+    db = database.db
+    results = db.Rollup.aggregate([
+        {
+            '$match': {'_id.transportation_mode': {'$ne': None}}
+        },
+        {
+            '$group': {'_id': '$_id.transportation_mode', 'activity_count': {'$sum': '$count'}}
+        }
+    ])
+    return list(results)
+
+def q6a_rollup(database : Database) -> int:
+    db = database.db
+    results = list(db.Rollup.aggregate([
+        {
+            '$group': {'_id': '$_id.year', 'count': {'$sum': '$count'}}
+        },
+        {
+            '$sort': {'count': -1}
+        },
+        {
+            '$limit': 1
+        }
+    ]))
+    return results[0]['_id']
+
+def q6b_rollup(database : Database) -> int:
+    db = database.db
+    results = list(db.Rollup.aggregate([
+        {
+            '$group': {'_id': '$_id.year', 'hours': {'$sum': '$duration'}}
+        },
+        {
+            '$sort': {'hours': -1}
+        },
+        {
+            '$limit': 1
+        }
+    ]))
+    return results[0]['_id']
+
+def q11_rollup(database : Database) -> list:
+    db = database.db
+    results = db.Rollup.aggregate([
+        {
+            '$match': {'_id.transportation_mode': {'$ne': None}}
+        },
+        {
+            '$group':
             {
-                '_id': {'user': '$user', 'transportation_mode': '$transportation_mode'},
-                'count': {'$sum': 1}
+                '_id': {'user': '$_id.user', 'transportation_mode': '$_id.transportation_mode'},
+                'count': {'$sum': '$count'}
             }
         },
         {
-            '$sort': 
+            '$sort':
             {
                 '_id.user': 1,
                 'count': -1
@@ -317,22 +645,292 @@ def q11(database : Database) -> None:
     ])
 
     results = [(i['_id']['user'], i['transportation_mode']) for i in results]
-    print('Question 11:\n')
-    print('Most used transportation mode by user:')
-    pprint(list(results))
-    print()
+    return list(results)
+
+def q7_store(database : Database, user : str = WALK_USER, start : datetime = WALK_START, end : datetime = WALK_END, store : Optional[str] = None) -> float:
+    store = open_store(store, database)
+    if user not in store.user_index or 'walk' not in store.modes:
+        return 0
+    walk = store.modes.index('walk')
+    distance_walked = 0
+    for activity in store.user_activities(user):
+        if store.activity_mode[activity] != walk:
+            continue
+        points = store.activity_points(activity)
+        date_time = store.date_time[points]
+        inside = (date_time >= np.datetime64(start)) & (date_time < np.datetime64(end))
+        distance_walked += Kernels.path_length(store.lat[points][inside], store.lon[points][inside])
+
+    return distance_walked
+
+def q8_store(database : Database, store : Optional[str] = None) -> list:
+    store = open_store(store, database)
+    results = []
+    for u, user in enumerate(store.users): # One user at a time, only their pages are read
+        points = store.user_points(u)
+        altitude = store.altitude[points]
+        valid = altitude != Kernels.INVALID_ALTITUDE
+        gained = Kernels.segment_positive_deltas(altitude[valid], store.activity[points][valid]).sum()
+        results.append({'user': user, 'gained': int(gained*0.3048)})
+    results = sorted(results, key=lambda item: item['gained'], reverse=True)
+
+    return results[:20]
+
+def q9_store(database : Database, store : Optional[str] = None) -> dict:
+    store = open_store(store, database)
+    results = {}
+    for u, user in enumerate(store.users):
+        points = store.user_points(u)
+        activity = store.activity[points]
+        gaps = Kernels.segment_gaps(store.date_time[points], activity)
+        invalid = len(np.unique(activity[gaps > timedelta(minutes=5).total_seconds()]))
+        if invalid:
+            results[user] = invalid
+
+    return results
+
+def q10_store(database : Database, coords : tuple[float, float] = CITY_COORDS, radius : float = CITY_RADIUS, store : Optional[str] = None) -> list:
+    store = open_store(store, database)
+    users = []
+    for u, user in enumerate(store.users):
+        points = store.user_points(u)
+        if (Kernels.haversine_to(store.lat[points], store.lon[points], coords) <= radius / 1000).any():
+            users.append(user)
+
+    return users
+
+# The questions: name -> (title, description, function)
+QUERIES = {
+    'q1': ('Question 1', 'Number of documents per collection:', q1),
+    'q2': ('Question 2', 'Average number of activities per user:', q2),
+    'q3': ('Question 3', 'Top users by number of activities:', q3),
+    'q4': ('Question 4', 'Users that have used a taxi:', q4),
+    'q5': ('Question 5', 'Transportation modes and number of activities:', q5),
+    'q6a': ('Question 6(a)', 'Year with the greatest number of activities:', q6a),
+    'q6b': ('Question 6(b)', 'Year with the greatest number of hours recorded:', q6b),
+    'q7': ('Question 7', 'Total distance walked by user 112 (kilometers):', q7),
+    'q8': ('Question 8', 'Top 20 users who have gained the most altitude in meters (gross):', q8),
+    'q9': ('Question 9', 'Users that have invalid activities and the number of invalid activities per user:', q9),
+    'q10': ('Question 10', 'Users that have been to the forbidden city (within 1000 meters of center):', q10),
+    'q11': ('Question 11', 'Most used transportation mode by user:', q11),
+    'q7_summary': ('Question 7 (activity summaries)', 'Total distance walked by user 112 (kilometers):', q7_summary),
+    'q8_summary': ('Question 8 (activity summaries)', 'Top 20 users who have gained the most altitude in meters (gross):', q8_summary),
+    'q9_summary': ('Question 9 (activity summaries)', 'Users that have invalid activities and the number of invalid activities per user:', q9_summary),
+    'q8_pipeline': ('Question 8 (server pipeline)', 'Top 20 users who have gained the most altitude in meters (gross):', q8_pipeline),
+    'q8_columnar': ('Question 8 (columnar)', 'Top 20 users who have gained the most altitude in meters (gross):', q8_columnar),
+    'q10_columnar': ('Question 10 (columnar)', 'Users that have been to the forbidden city (within 1000 meters of center):', q10_columnar),
+    'q1_bucket': ('Question 1 (bucket layout)', 'Number of documents per collection (trackpoints in TrackPointBucket):', q1_bucket),
+    'q7_bucket': ('Question 7 (bucket layout)', 'Total distance walked by user 112 (kilometers):', q7_bucket),
+    'q8_bucket': ('Question 8 (bucket layout)', 'Top 20 users who have gained the most altitude in meters (gross):', q8_bucket),
+    'q9_bucket': ('Question 9 (bucket layout)', 'Users that have invalid activities and the number of invalid activities per user:', q9_bucket),
+    'q10_bucket': ('Question 10 (bucket layout)', 'Users that have been to the forbidden city (within 1000 meters of center):', q10_bucket),
+    'q2_rollup': ('Question 2 (rollups)', 'Average number of activities per user:', q2_rollup),
+    'q3_rollup': ('Question 3 (rollups)', 'Top users by number of activities:', q3_rollup),
+    'q5_rollup': ('Question 5 (rollups)', 'Transportation modes and number of activities:', q5_rollup),
+    'q6a_rollup': ('Question 6(a) (rollups)', 'Year with the greatest number of activities:', q6a_rollup),
+    'q6b_rollup': ('Question 6(b) (rollups)', 'Year with the greatest number of hours recorded:', q6b_rollup),
+    'q11_rollup': ('Question 11 (rollups)', 'Most used transportation mode by user:', q11_rollup),
+    'q7_store': ('Question 7 (column store)', 'Total distance walked by user 112 (kilometers):', q7_store),
+    'q8_store': ('Question 8 (column store)', 'Top 20 users who have gained the most altitude in meters (gross):', q8_store),
+    'q9_store': ('Question 9 (column store)', 'Users that have invalid activities and the number of invalid activities per user:', q9_store),
+    'q10_store': ('Question 10 (column store)', 'Users that have been to the forbidden city (within 1000 meters of center):', q10_store),
+}
+POINT_QUERIES = ['q1', 'q2', 'q3', 'q4', 'q5', 'q6a', 'q6b', 'q7', 'q8', 'q9', 'q10', 'q11']
+BUCKET_QUERIES = ['q1_bucket', 'q2', 'q3', 'q4', 'q5', 'q6a', 'q6b', 'q7_bucket', 'q8_bucket', 'q9_bucket', 'q10_bucket', 'q11']
+STORE_QUERIES = ['q1', 'q2', 'q3', 'q4', 'q5', 'q6a', 'q6b', 'q7_store', 'q8_store', 'q9_store', 'q10_store', 'q11']
+ROLLUP_QUERIES = {'q2': 'q2_rollup', 'q3': 'q3_rollup', 'q5': 'q5_rollup', 'q6a': 'q6a_rollup', 'q6b': 'q6b_rollup', 'q11': 'q11_rollup'} # Replacements with --rollups
+
+def user_ranges(database : Database, parts : int, **params) -> list[tuple]:
+    return database.id_ranges('User', parts)
+
+def walk_ranges(database : Database, parts : int, user : str = WALK_USER, **params) -> list[tuple]:
+    return database.id_ranges('Activity', parts, {'user': user, 'transportation_mode': 'walk'})
+
+def merge_top(results : list[list], n : int = 20) -> list:
+    # The users of the partitions are disjoint, so the top n overall are among the top n of the partitions
+    return sorted([row for result in results for row in result], key=lambda item: item['gained'], reverse=True)[:n]
+
+def merge_dicts(results : list[dict]) -> dict:
+    return {key : value for result in results for key, value in result.items()}
+
+def merge_lists(results : list[list]) -> list:
+    return [item for result in results for item in result]
+
+# The questions that can run as partitions: name -> (range parameter, ranges, merge of the partial results)
+PARTITIONED = {
+    'q7': ('activity_range', walk_ranges, sum),
+    'q8': ('user_range', user_ranges, merge_top),
+    'q9': ('user_range', user_ranges, merge_dicts),
+    'q10': ('user_range', user_ranges, merge_lists),
+}
+
+_worker_database = None # The database of a partition worker process
+
+def _run_partition(name : str, params : dict) -> Any:
+    """
+    Process pool entry point. Every worker process queries over its own client.
+    """
+    global _worker_database
+    if _worker_database is None:
+        _worker_database = Database(profile='analytics')
+    return QUERIES[name][2](_worker_database, **params)
+
+def run_partitioned(database : Database, name : str, executor : Executor, parts : int, **params) -> Any:
+    """
+    Runs a question as ranges of users (or activities) on a process pool and merges the partial results
+    into the result of the serial question
+    :param database: The database (used to compute the ranges)
+    :param name: The name of the question in PARTITIONED
+    :param executor: The process pool
+    :param parts: The number of partitions
+    :param params: The parameters of the question
+    :returns: The merged result
+    """
+    parameter, ranges, merge = PARTITIONED[name]
+    futures = [executor.submit(_run_partition, name, {**params, parameter: bounds}) for bounds in ranges(database, parts, **params)]
+    return merge([future.result() for future in futures])
+
+def cache_params(name : str, params : dict) -> dict:
+    """
+    Resolves the parameters a question runs with, for its cache key: the defaults are filled in, so changing a default
+    changes the key, and the store of a _store question is replaced by its path and the generation it was exported at
+    :param name: The name of the question in QUERIES
+    :param params: The parameters given to the question
+    :returns: The effective parameters
+    """
+    bound = inspect.signature(QUERIES[name][2]).bind(None, **params)
+    bound.apply_defaults()
+    resolved = dict(list(bound.arguments.items())[1:]) # Without the database
+    if 'store' in resolved:
+        store = open_store(resolved['store'])
+        resolved['store'] = (str(store.path.resolve()), store.source, store.generation, store.built)
+    return resolved
+
+def run_query(database : Database,
+              name : str,
+              cache : Optional[QueryCache] = None,
+              executor : Optional[Executor] = None,
+              partitions : int = 1,
+              profiler : Optional[Profiler] = None,
+              **params) -> dict:
+    """
+    Runs a single question and times it
+    :param database: The database
+    :param name: The name of the question in QUERIES
+    :param cache: Return the cached result of the current dataset generation if there is one, and cache new results (None = no caching)
+    :param executor: Run the questions in PARTITIONED as partitions on this process pool (None = serially)
+    :param partitions: The number of partitions
+    :param profiler: Record the question as a stage of this profiler
+    :param params: The parameters of the question (e.g. user, start and end of q7, coords and radius of q10)
+    :returns: The run as {'query', 'result', 'seconds', 'rows', 'error', 'cached'}
+    """
+    start = time.perf_counter()
+    result, error, cached = MISSING, None, False
+    try:
+        with database.phase(name), (profiler.stage(name) if profiler else nullcontext()):
+            if cache is not None:
+                key = QueryCache.key(name, cache_params(name, params), database.generation())
+                result = cache.get(key)
+                cached = result is not MISSING
+            if not cached:
+                if executor is not None and name in PARTITIONED:
+                    result = run_partitioned(database, name, executor, partitions, **params)
+                else:
+                    result = QUERIES[name][2](database, **params)
+                if cache is not None:
+                    cache.put(key, result) # Failed questions are not cached
+    except Exception as e:
+        result, error = None, e
+    seconds = time.perf_counter() - start
+    rows = len(result) if isinstance(result, (list, dict)) else int(result is not None)
+    return {'query': name, 'result': result, 'seconds': seconds, 'rows': rows, 'error': repr(error) if error else None, 'cached': cached}
+
+def run_queries(database : Database,
+                names : list[str],
+                workers : int = 4,
+                cache : Optional[QueryCache] = None,
+                partitions : int = 1,
+                profiler : Optional[Profiler] = None) -> list[dict]:
+    """
+    Runs questions concurrently on a thread pool (the shared MongoClient is thread safe)
+    :param database: The database
+    :param names: The names of the questions in QUERIES
+    :param workers: The number of questions that run at the same time (1 = one after another in the calling thread)
+    :param cache: The result cache, the entries of older generations are pruned first (None = no caching)
+    :param partitions: Run the questions in PARTITIONED as this many partitions on a pool of as many processes (1 = serially)
+    :param profiler: Record every question as a stage of this profiler
+    :returns: The runs in the same order as names
+    """
+    if cache is not None:
+        cache.prune(database.generation())
+    # Spawned, not forked: the pool is started from a question thread while the other threads are inside pymongo
+    processes = ProcessPoolExecutor(max_workers=partitions, mp_context=multiprocessing.get_context('spawn')) if partitions > 1 else None
+    try:
+        if workers <= 1: # In the calling thread, where cProfile can see the questions
+            return [run_query(database, name, cache, processes, partitions, profiler) for name in names]
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            return list(executor.map(lambda name: run_query(database, name, cache, processes, partitions, profiler), names))
+    finally:
+        if processes is not None:
+            processes.shutdown()
+
+def print_runs(runs : list[dict]) -> None:
+    """
+    Prints the results of the runs in order, followed by a table of their timings
+    :param runs: The runs returned by run_queries()
+    """
+    for run in runs:
+        title, description, _ = QUERIES[run['query']]
+        print(f'{title}\n')
+        print(description)
+        if run['error']:
+            print(f'FAILED: {run["error"]}')
+        else:
+            pprint(run['result'])
+        print()
+    print(tabulate([{'query': run['query'],
+                     'seconds': round(run['seconds'], 3),
+                     'rows': run['rows'],
+                     'status': 'failed' if run['error'] else 'cached' if run['cached'] else 'ok'} for run in runs], headers='keys'))
 
 if __name__ == '__main__':
-    db = Database()
-    q1(db)
-    q2(db)
-    q3(db)
-    q4(db)
-    q5(db)
-    q6a(db)
-    q6b(db)
-    q7(db)
-    q8(db)
-    q9(db)
-    q10(db)
-    q11(db)
\ No newline at end of file
+    parser = argparse.ArgumentParser(description='Run the part 2 questions')
+    parser.add_argument('--layout', choices=('point', 'bucket', 'store'), default='point', help='The TrackPoint layout the data was loaded with (store = answer q7-q10 from the local column store)')
+    parser.add_argument('--rollups', action='store_true', help='Answer q2, q3, q5, q6a, q6b and q11 from the Rollup collection maintained by part1')
+    parser.add_argument('--store', default=None, help='The directory of the column store (default: $TRACKPOINT_STORE or trackpoints.store)')
+    parser.add_argument('-q', '--queries', nargs='+', choices=QUERIES.keys(), help='The questions to run (default: all questions of the layout)')
+    parser.add_argument('-w', '--workers', type=int, default=4, help='Number of questions that run concurrently')
+    parser.add_argument('--instrument', action='store_true', help='Print the database commands (latency, documents, bytes, getMores) of every question')
+    parser.add_argument('--instrument-json', default=None, help='Also write the database command report to this JSON file')
+    parser.add_argument('-p', '--partitions', type=int, default=1, help='Run q7-q10 as this many user (or activity) ranges on as many processes')
+    parser.add_argument('--cache-dir', default=None, help='Cache the results in this directory, until part1 loads new data')
+    parser.add_argument('--profile', action='store_true', help='Print the time of every question')
+    parser.add_argument('--profile-memory', action='store_true', help='Also print the tracemalloc peak of every question and the top allocation sites (slow)')
+    parser.add_argument('--cprofile', default=None, help='Also write cProfile statistics to this file (only sees the questions with --workers 1)')
+    parser.add_argument('--profile-json', default=None, help='Also write the profile report to this JSON file')
+    args = parser.parse_args()
+
+    db = Database(profile='analytics', instrument=args.instrument or args.instrument_json is not None)
+    STORE_PATH = args.store or STORE_PATH
+    names = args.queries or {'point': POINT_QUERIES, 'bucket': BUCKET_QUERIES, 'store': STORE_QUERIES}[args.layout]
+    if args.rollups:
+        names = [ROLLUP_QUERIES.get(name, name) for name in names]
+    cache = QueryCache(directory=args.cache_dir) if args.cache_dir else None
+    profiler = None
+    if args.profile or args.profile_memory or args.cprofile or args.profile_json:
+        profiler = Profiler(cprofile=args.cprofile, memory=args.profile_memory)
+        profiler.start()
+    runs = run_queries(db, names, args.workers, cache, args.partitions, profiler)
+    if profiler:
+        profiler.stop()
+    print_runs(runs)
+    if db.recorder:
+        print()
+        print(db.recorder.table())
+        if args.instrument_json:
+            db.recorder.dump(args.instrument_json)
+    if profiler:
+        print()
+        print(profiler.table())
+        if args.profile_json:
+            profiler.dump(args.profile_json)